@@ -0,0 +1,66 @@
+"""Encoder throughput without hardware.
+
+Feeds synthetic PCM in every format get_optimal_settings can pick through the
+encoder commands Recorder.start uses and reports realtime factor and CPU.
+
+    python -m bench.encoders --seconds 20 --min-realtime 1.5
+"""
+import argparse
+import resource
+import subprocess
+import sys
+import time
+
+from devices.audio import PREFERRED_FORMATS
+from pipeline.encoders import ENCODERS
+from bench.synthetic import synthetic_pcm, wav_header
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def run_encoder(encoder, audio, seconds):
+    """Encode audio (WAV bytes) as fast as the encoder accepts it; returns (realtime, cpu share) or None."""
+    cpu_before = children_cpu()
+    started = time.monotonic()
+    try:
+        result = subprocess.run(encoder.command(), input=audio, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        return None, f"{encoder.command()[0]} not installed"
+    wall = time.monotonic() - started
+    cpu = children_cpu() - cpu_before
+    if result.returncode != 0:
+        lines = result.stderr.decode(errors="ignore").strip().splitlines()
+        return None, lines[-1] if lines else f"exit status {result.returncode}"
+    return (seconds / wall, cpu / seconds), None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=10, help="audio per configuration")
+    parser.add_argument("--encoders", default=",".join(ENCODERS), help="comma separated ENCODERS names")
+    parser.add_argument("--formats", default=",".join(PREFERRED_FORMATS))
+    parser.add_argument("--channels", default="1,2")
+    parser.add_argument("--min-realtime", type=float, default=0,
+                        help="exit non-zero if any configuration is slower than this")
+    args = parser.parse_args(argv)
+
+    print(f"{'encoder':<12} {'format':<8} {'ch':>2} {'realtime':>9} {'cpu/s':>7}")
+    slow = []
+    for audio_format in args.formats.split(","):
+        for channels in (int(c) for c in args.channels.split(",")):
+            audio = wav_header(audio_format, channels) + synthetic_pcm(audio_format, channels, args.seconds)
+            for name in args.encoders.split(","):
+                result, error = run_encoder(ENCODERS[name], audio, args.seconds)
+                if result is None:
+                    print(f"{name:<12} {audio_format:<8} {channels:>2}   error: {error}")
+                    slow.append(name)
+                    continue
+                realtime, cpu_share = result
+                print(f"{name:<12} {audio_format:<8} {channels:>2} {realtime:>8.1f}x {cpu_share:>7.3f}")
+                if realtime < args.min_realtime:
+                    slow.append(name)
+    return 1 if slow else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""Stand-in for arecord: reports one USB card and streams synthetic PCM in realtime.
+
+Installed on PATH as "arecord" by bench.fakes.install_fake_arecord."""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.synthetic import synthetic_second, wav_header  # noqa: E402
+
+FORMATS = os.environ.get("BENCH_ARECORD_FORMATS", "S24_3LE S16_LE")
+CHANNELS = os.environ.get("BENCH_ARECORD_CHANNELS", "1 2")
+CACHE_DIR = os.environ.get("BENCH_ARECORD_CACHE")
+
+def cached_second(audio_format, channels, rate):
+    """Generating a second of audio in Python is slow enough to skew start latency,
+    so install_fake_arecord pre-renders them into CACHE_DIR."""
+    if CACHE_DIR:
+        path = os.path.join(CACHE_DIR, f"{audio_format}-{channels}-{rate}.pcm")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return f.read()
+    return synthetic_second(audio_format, channels, rate)
+
+def option(args, name, default):
+    return args[args.index(name) + 1] if name in args else default
+
+def main(args):
+    if "-l" in args:
+        print("card 1: Bench [Bench USB Audio], device 0: USB Audio [USB Audio]")
+        return
+    if "--dump-hw-params" in args:
+        sys.stderr.write(f"FORMAT: {FORMATS}\nCHANNELS: [{CHANNELS}]\nRATE: [44100 48000]\n")
+        return
+
+    rate = int(option(args, "-r", "48000"))
+    channels = int(option(args, "-c", "2"))
+    audio_format = option(args, "-f", "S16_LE")
+    second = cached_second(audio_format, channels, rate)
+    block = len(second) // 100  # 10ms, always a whole number of frames at 48kHz
+    out = sys.stdout.buffer
+    out.write(wav_header(audio_format, channels, rate))
+    out.flush()
+    started = time.monotonic()
+    sent = 0
+    try:
+        while True:
+            position = (sent * block) % len(second)
+            out.write(second[position:position + block])
+            out.flush()
+            sent += 1
+            # Pace on the clock so the stream matches a real card over long runs
+            delay = started + sent * 0.01 - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,98 @@
+import asyncio
+import collections
+import os
+import stat
+import sys
+import time
+
+import evdev
+from config import Config
+from devices.audio import PREFERRED_FORMATS
+from bench.synthetic import synthetic_second
+
+def install_fake_arecord(directory):
+    """Put a fake arecord first on PATH; encoders stay the real binaries."""
+    os.makedirs(directory, exist_ok=True)
+    for audio_format in PREFERRED_FORMATS:
+        for channels in (1, 2):
+            with open(os.path.join(directory, f"{audio_format}-{channels}-{Config.SAMPLE_RATE}.pcm"), "wb") as f:
+                f.write(synthetic_second(audio_format, channels))
+    os.environ["BENCH_ARECORD_CACHE"] = directory
+    script = os.path.join(directory, "arecord")
+    fake = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_arecord.py")
+    with open(script, "w") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{fake}" "$@"\n')
+    os.chmod(script, os.stat(script).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    os.environ["PATH"] = directory + os.pathsep + os.environ.get("PATH", "")
+
+class FakeBulb:
+    """Stands in for kasa.SmartBulb; every command takes `latency` seconds."""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.alias = Config.BULB_NAME
+        self.host = "127.0.0.1"
+        self.is_on = False
+        self.is_color = True
+        self.brightness = 100
+        self.hsv = (0, 0, 100)
+        self.acks = asyncio.Queue()  # (wall time, recording light on) per completed change
+
+    async def update(self):
+        await asyncio.sleep(self.latency)
+
+    async def turn_on(self):
+        await asyncio.sleep(self.latency)
+        self.is_on = True
+
+    async def turn_off(self):
+        await asyncio.sleep(self.latency)
+        self.is_on = False
+        self.acks.put_nowait((time.time(), False))
+
+    async def set_hsv(self, hue, saturation, value):
+        await asyncio.sleep(self.latency)
+        self.hsv = (hue, saturation, value)
+        self.acks.put_nowait((time.time(), True))
+
+class FakeInputDevice:
+    """evdev.InputDevice look-alike with a real fd, so TriggerListener's
+    add_reader path is exercised exactly as with a paired remote."""
+
+    def __init__(self, path="/dev/input/event-bench", name="Bench Bluetooth Remote"):
+        self.path = path
+        self.name = name
+        self.uniq = "00:00:00:00:00:00"
+        self.fd, self.write_fd = os.pipe()
+        os.set_blocking(self.fd, False)
+        self.events = collections.deque()
+
+    def capabilities(self):
+        return {evdev.ecodes.EV_KEY: [Config.TRIGGER_KEY_CODE]}
+
+    def press(self):
+        """Queue a key down/up pair stamped like the kernel would; returns the press time."""
+        now = time.time()
+        sec, usec = int(now), int((now % 1) * 1_000_000)
+        for value in (1, 0):
+            self.events.append(evdev.InputEvent(sec, usec, evdev.ecodes.EV_KEY, Config.TRIGGER_KEY_CODE, value))
+        os.write(self.write_fd, b"\0")
+        return sec + usec / 1_000_000
+
+    def read(self):
+        try:
+            os.read(self.fd, 4096)
+        except BlockingIOError:
+            pass
+        if not self.events:
+            raise BlockingIOError
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+    def close(self):
+        for fd in (self.fd, self.write_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
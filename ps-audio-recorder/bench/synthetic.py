@@ -0,0 +1,59 @@
+import math
+import random
+import struct
+
+from config import Config
+from pipeline.capture import SAMPLE_WIDTHS
+
+# Container bits written to the WAV header for each arecord format
+CONTAINER_BITS = {
+    "S16_LE": 16,
+    "S24_3LE": 24,
+    "S24_LE": 32,
+    "S32_LE": 32,
+}
+
+STREAMING_DATA_SIZE = 0x7FFFF000  # placeholder arecord writes when the length is unknown
+
+def wav_header(audio_format, channels, rate=None, data_bytes=STREAMING_DATA_SIZE):
+    """Minimal PCM WAV header like the one arecord -t wav emits."""
+    rate = rate or Config.SAMPLE_RATE
+    width = SAMPLE_WIDTHS[audio_format]
+    block_align = width * channels
+    return (
+        b"RIFF" + struct.pack("<I", min(data_bytes + 36, 0xFFFFFFFF)) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, rate, rate * block_align,
+                                block_align, CONTAINER_BITS[audio_format])
+        + b"data" + struct.pack("<I", data_bytes)
+    )
+
+def encode_sample(value, audio_format):
+    """value is a signed 24-bit sample."""
+    if audio_format == "S16_LE":
+        return struct.pack("<h", value >> 8)
+    if audio_format == "S24_3LE":
+        return struct.pack("<i", value)[:3]
+    if audio_format == "S24_LE":
+        return struct.pack("<i", value)
+    return struct.pack("<i", value << 8)
+
+def synthetic_second(audio_format, channels, rate=None, seed=0):
+    """One second of a tone with program-like noise on top, so encoders do real work."""
+    rate = rate or Config.SAMPLE_RATE
+    rng = random.Random(seed)
+    peak = (1 << 23) - 1
+    frames = bytearray()
+    for n in range(rate):
+        t = n / rate
+        tone = 0.25 * math.sin(2 * math.pi * 440 * t) + 0.1 * math.sin(2 * math.pi * 1250 * t)
+        for channel in range(channels):
+            value = int(peak * (tone + 0.05 * (rng.random() - 0.5) + 0.01 * channel))
+            frames += encode_sample(max(-peak, min(peak, value)), audio_format)
+    return bytes(frames)
+
+def synthetic_pcm(audio_format, channels, seconds, rate=None):
+    second = synthetic_second(audio_format, channels, rate)
+    whole, fraction = divmod(seconds, 1)
+    frame_bytes = SAMPLE_WIDTHS[audio_format] * channels
+    tail = int(len(second) * fraction) // frame_bytes * frame_bytes
+    return second * int(whole) + second[:tail]
@@ -0,0 +1,118 @@
+"""Toggle latency without hardware.
+
+Presses a fake evdev remote and measures press-to-recording, press-to-light,
+press-to-stopped and press-to-light-off from the event's kernel timestamp,
+with a fake arecord streaming in realtime and a stub bulb. Encoders are the
+real binaries.
+
+    python -m bench.toggle --presses 20 --hold 2
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from config import Config
+from bench.fakes import FakeBulb, FakeInputDevice, install_fake_arecord
+
+def summarize(name, samples):
+    if not samples:
+        return f"{name:<20} no samples"
+    ms = sorted(s * 1000 for s in samples)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    return (f"{name:<20} n={len(ms):<3} min={ms[0]:7.1f}  median={statistics.median(ms):7.1f}  "
+            f"p95={p95:7.1f}  max={ms[-1]:7.1f} ms")
+
+def configure(work_dir):
+    Config.RECORDING_DIR = os.path.join(work_dir, "recordings")
+    Config.AUDIO_CACHE_FILE = os.path.join(work_dir, "audio_caps.json")
+    Config.CATALOG_FILE = os.path.join(work_dir, "catalog.db")
+    Config.LOG_FILE = os.path.join(work_dir, "bench.log")
+    Config.TRANSCODE_TO = None
+    Config.RECORDING_GROUP = None  # files keep the caller's group
+    os.makedirs(Config.RECORDING_DIR, exist_ok=True)
+    install_fake_arecord(os.path.join(work_dir, "bin"))
+
+async def run(presses, hold, bulb_latency):
+    # Imported after configure() so module-level state sees the bench Config
+    from devices.input import InputDeviceRegistry, TriggerListener
+    from recorder import Recorder
+    from utils.trace import tracer
+
+    recorder = Recorder()
+    await recorder.open()
+    bulb = FakeBulb(bulb_latency)
+    recorder.set_light(bulb)
+
+    toggled = asyncio.Queue()
+
+    def on_press(event):
+        # Same as main(): the press goes on the recorder's command queue
+        done = recorder.submit("toggle", tracer.begin("toggle", "button", event.timestamp()))
+        done.add_done_callback(
+            lambda _: toggled.put_nowait((time.time() - event.timestamp(), recorder.is_recording())))
+
+    registry = InputDeviceRegistry()
+    listener = TriggerListener(registry, on_press)
+    listener.start()
+    device = FakeInputDevice()
+    registry.devices[device.path] = device
+    registry.notify_added(listener.on_added, device, False)
+
+    results = {"to recording": [], "to light on": [], "to stopped": [], "to light off": [], "failed starts": []}
+    dispatcher = asyncio.create_task(recorder.run())
+    try:
+        for _ in range(presses):
+            for expect_recording, toggle_key, light_key in ((True, "to recording", "to light on"),
+                                                            (False, "to stopped", "to light off")):
+                pressed = device.press()
+                latency, recording = await asyncio.wait_for(toggled.get(), timeout=30)
+                if recording != expect_recording:
+                    results["failed starts"].append(latency)
+                    break
+                results[toggle_key].append(latency)
+                try:
+                    acked, light_on = await asyncio.wait_for(bulb.acks.get(), timeout=10)
+                    if light_on == expect_recording:
+                        results[light_key].append(acked - pressed)
+                except asyncio.TimeoutError:
+                    pass
+                if expect_recording:
+                    await asyncio.sleep(hold)
+            # Presses closer together than this would be debounced
+            await asyncio.sleep(Config.PRESS_DEBOUNCE_SECONDS + 0.2)
+    finally:
+        dispatcher.cancel()
+        listener.close()
+        registry.close()
+        device.close()
+        await recorder.close()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--presses", type=int, default=10, help="record/stop cycles")
+    parser.add_argument("--hold", type=float, default=1.0, help="seconds to record per cycle")
+    parser.add_argument("--bulb-latency", type=float, default=0.05, help="seconds per stub bulb command")
+    parser.add_argument("--encoder", default=Config.ENCODER)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="ps-audio-bench-") as work_dir:
+        configure(work_dir)
+        Config.ENCODER = args.encoder
+        results = asyncio.run(run(args.presses, args.hold, args.bulb_latency))
+
+    print()
+    for name, samples in results.items():
+        if name != "failed starts":
+            print(summarize("press " + name, samples))
+    if results["failed starts"]:
+        print(f"{len(results['failed starts'])} toggles did not reach the expected state")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
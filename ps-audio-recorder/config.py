@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import Optional, NamedTuple
+from dataclasses import dataclass, field
+from typing import List, Optional, NamedTuple
 import os
 
 class HSV(NamedTuple):
@@ -10,13 +10,47 @@ class HSV(NamedTuple):
 class Config:
     SAMPLE_RATE = 48000
     CHANNELS = 2
+    PREROLL_SECONDS = 0  # audio kept from before the press; >0 keeps capture always running
+    RECORD_ALL_DEVICES = True  # one file per USB audio interface when several are connected
+    PIPELINE_CPU_AFFINITY = True  # pin each device's arecord and encoder to their own cores, away from core 0
+    CAPTURE_RT_PRIORITY = 40  # SCHED_FIFO priority for arecord (0 = normal scheduling); needs LimitRTPRIO
+    CAPTURE_NICE = -10  # nice for arecord when SCHED_FIFO is off or refused (None leaves it)
+    ENCODER_NICE = -5  # ahead of smbd/Bluetooth, behind arecord; a starved encoder backs up into capture
+    ENCODER_IONICE = (2, 0)  # ionice class and level for the encoder (None leaves it)
+    LOCK_MEMORY = False  # mlockall the recorder so the capture pump is never paged out; needs LimitMEMLOCK
     AUDIO_FORMAT = "S32_LE"
     RECORDING_DIR = "/srv/recordings"
+    RECORDING_GROUP = "audiofiles"  # group given to recordings and the control socket (None keeps the default)
     MAX_RECORDING_TIME = 3600
+    STOP_AT_MAX_RECORDING_TIME = False  # stop automatically after MAX_RECORDING_TIME seconds
+    SEGMENT_SECONDS = 0  # roll over to a new file every N seconds of audio (0 disables)
+    SEGMENT_MAX_BYTES = 0  # roll over when the current file reaches this size (0 disables)
+    START_TIMEOUT = 3  # seconds to wait for the first audio to reach the encoder
+    FSYNC_INTERVAL = 10  # seconds between syncs of the file being recorded (0 = only when it is finalized)
+    STORAGE_RESERVE_MB = 200  # free space kept untouched in RECORDING_DIR
+    STORAGE_MIN_FREE_SECONDS = 300  # refuse to start with room for less audio than this
+    STORAGE_PREALLOCATE_MB = 256  # per-segment fallocate cap (0 disables)
+    STORAGE_RETENTION = False  # delete the oldest recordings instead of stopping when space runs out
+    STORAGE_CHECK_INTERVAL = 10  # seconds between free space checks while recording
+    LEVEL_METER = True  # RMS/peak metering while recording (needs numpy)
+    LEVEL_WINDOW = 0.1  # seconds per metering window
+    LEVEL_QUEUE_BLOCKS = 32  # capture blocks queued for the meter before it skips ahead
+    CLIP_THRESHOLD_DB = -0.1  # peak level (dBFS) counted as clipping
+    CLIP_WARNING_INTERVAL = 5  # seconds between clipping warnings
+    SILENCE_STOP_SECONDS = 0  # stop after this long below SILENCE_THRESHOLD_DB (0 disables)
+    SILENCE_THRESHOLD_DB = -50
+    PEAKS = True  # write a waveform sidecar (<file>.peaks) while recording (needs numpy)
+    PEAKS_RESOLUTIONS = (256, 4096, 65536)  # frames per min/max point, one level each
     TRIGGER_KEY_CODE = 115
+    PRESS_DEBOUNCE_SECONDS = 0.3  # button presses this soon after the last one are ignored (bounce, double-firing remotes)
+    LIGHT_ENABLED = True  # find and drive the Kasa recording light
     BULB_NAME = "Recording Light"
     BULB_CACHE_FILE = "/var/lib/audio-recorder/last_bulb.json"
     BULB_DISCOVERY_TIMEOUT = 8  # seconds
+    BULB_DISCOVERY_CONCURRENCY = 4  # devices updated in parallel during discovery
+    BULB_REVALIDATE_INTERVAL = 600  # seconds between checks of the cached bulb IP
+    AUDIO_CACHE_FILE = "/var/lib/audio-recorder/audio_caps.json"
+    CATALOG_FILE = "/var/lib/audio-recorder/catalog.db"  # SQLite index of recordings (None disables)
     RECORDING_HUE = 0
     RECORDING_SATURATION = 100
     RECORDING_BRIGHTNESS = 100
@@ -24,10 +58,43 @@ class Config:
     POWER_COMMAND_DELAY = 1.2
     COLOR_COMMAND_DELAY = 1.1
     BRIGHTNESS_COMMAND_DELAY = 1.0
+    LIGHT_RETRY_DELAY = 1  # seconds; doubles per failed light command
+    LIGHT_RETRY_MAX_DELAY = 30
+    LIGHT_RETRY_LIMIT = 5  # attempts before waiting for the next toggle
     RECORDING_PREFIX = "audio-recorder"
     TIMESTAMP_FORMAT = "%Y-%m-%d-%H-%M-%S"
-    LOG_FILE = "/var/log/audio-recorder.log"
-    RECORDING_EXTENSION = "mp3"
+    LOG_FILE = "/var/log/audio-recorder/audio-recorder.log"  # its directory must be writable for rotation
+    LOG_MAX_BYTES = 5 * 1024 * 1024  # rotate the log file at this size
+    LOG_BACKUP_COUNT = 3
+    LOG_JSON = False  # write JSON lines (with event fields) to LOG_FILE instead of plain text
+    ENCODER = "mp3-extreme"  # mp3-extreme, mp3-v2, mp3-v5, flac or wav
+    ENCODER_ADAPTIVE = True  # switch to a cheaper encoder mid-take when falling behind
+    ENCODER_FALLBACKS = ["mp3-v5", "flac", "wav"]  # tried in order, most expensive first
+    ENCODER_LAG_WINDOW = 5  # seconds per realtime measurement
+    ENCODER_LAG_THRESHOLD = 0.5  # fraction of the window the capture pump may wait on the encoder
+    TRANSCODE_TO = None  # e.g. "mp3-extreme": encode flac/wav takes in the background after stop
+    TRANSCODE_QUEUE_DIR = "/var/lib/audio-recorder/transcode"
+    TRANSCODE_WORKERS = 0  # 0 = one per core beyond two
+    TRANSCODE_NICE = 19
+    TRANSCODE_KEEP_SOURCE = False  # keep the lossless file after a successful transcode
+    TRANSCODE_MAX_ATTEMPTS = 3
+    REPLICATE_TO = None  # e.g. "/mnt/nas/recordings": mirror finished recordings there in the background
+    REPLICATE_QUEUE_DIR = "/var/lib/audio-recorder/replicate"
+    REPLICATE_RATE_MB = 20  # MB/s cap while idle (None = unlimited)
+    REPLICATE_RECORDING_RATE_MB = 1  # MB/s cap while recording (0 = wait until the take stops)
+    REPLICATE_CHUNK_MB = 8  # largest single copy
+    REPLICATE_RETRY_SECONDS = 60  # after an error, or while REPLICATE_TO is missing
+    REPLICATE_MAX_ATTEMPTS = 5
+    METRICS_ADDRESS = "127.0.0.1"
+    METRICS_PORT = 9464  # Prometheus text format at /metrics (0 disables)
+    METRICS_SOCKET = None  # e.g. "/run/audio-recorder/metrics.sock" to also serve on a unix socket
+    METRICS_SAMPLE_INTERVAL = 5  # seconds between /proc samples of the capture and encoder
+    CONTROL_SOCKET = "/var/lib/audio-recorder/control.sock"  # start/stop/toggle/status/segment (None disables)
+    CONTROL_ADDRESS = "127.0.0.1"
+    CONTROL_PORT = 0  # same commands over HTTP on CONTROL_ADDRESS, e.g. 5050 (0 disables); not 5000, which nginx serves to the LAN at /api/
+    TRACE_HISTORY = 50  # recent start/stop latency traces kept for the "trace" control command
+    TRACE_TIMEOUT = 10  # seconds to wait for the last stages (first encoded bytes, bulb) of a trace
+    STARTUP_PROFILE = False  # log per-phase start-up timings (or run main.py --profile-startup)
 
 @dataclass
 class BulbState:
@@ -35,3 +102,10 @@ class BulbState:
     brightness: Optional[int] = None
     hsv: Optional[HSV] = None
     color_temp: Optional[int] = None
+
+@dataclass
+class AudioCapabilities:
+    device: Optional[str]  # ALSA device (e.g. "hw:1,0"), None for the default device
+    formats: List[str] = field(default_factory=list)
+    channels: List[int] = field(default_factory=list)
+    rates: List[int] = field(default_factory=list)  # discrete rate or [min, max]
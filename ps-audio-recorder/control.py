@@ -0,0 +1,127 @@
+import asyncio
+import json
+import os
+import socket
+
+from utils.logging import log
+from utils.trace import tracer
+from config import Config
+from recorder import COMMAND_NAMES, recording_gid
+
+STATE_COMMANDS = COMMAND_NAMES + ("segment",)  # POST only over HTTP
+
+class ControlServer:
+    """Local control of the recorder over a unix socket and, optionally, localhost HTTP.
+
+    Socket protocol: one command per line (start, stop, toggle, status,
+    segment, trace), one JSON object per reply line; a connection can send any
+    number of commands. start/stop/toggle go through the recorder's command
+    queue like button presses and reply once done, or at once with
+    "<command> nowait".
+    HTTP: POST /<command>[?nowait] returns the same JSON; status and trace
+    also answer GET, so a prefetch or crawler can't change state."""
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.servers = []
+
+    async def start(self):
+        if Config.CONTROL_SOCKET:
+            try:
+                os.makedirs(os.path.dirname(Config.CONTROL_SOCKET), exist_ok=True)
+                if os.path.exists(Config.CONTROL_SOCKET):
+                    os.remove(Config.CONTROL_SOCKET)
+                self.servers.append(await asyncio.start_unix_server(self.handle_socket, path=Config.CONTROL_SOCKET))
+                os.chmod(Config.CONTROL_SOCKET, 0o660)
+                gid = recording_gid()
+                if gid is not None:
+                    try:
+                        os.chown(Config.CONTROL_SOCKET, -1, gid)
+                    except PermissionError:
+                        pass
+                log(f"Control socket listening on {Config.CONTROL_SOCKET}")
+            except Exception as e:
+                log(f"Could not start control socket: {str(e)}")
+        if Config.CONTROL_PORT:
+            try:
+                self.servers.append(await asyncio.start_server(
+                    self.handle_http, Config.CONTROL_ADDRESS, Config.CONTROL_PORT))
+                log(f"Control API listening on http://{Config.CONTROL_ADDRESS}:{Config.CONTROL_PORT}/")
+            except Exception as e:
+                log(f"Could not start control API: {str(e)}")
+
+    async def execute(self, line):
+        words = line.strip().lower().split()
+        if not words:
+            return {"ok": False, "error": "empty command"}
+        command, wait = words[0], "nowait" not in words[1:]
+        if command == "status":
+            return {"ok": True, **self.recorder.status()}
+        if command == "segment":
+            return {"ok": self.recorder.segment(), **self.recorder.status()}
+        if command == "trace":
+            return {"ok": True, **tracer.dump()}
+        if command not in COMMAND_NAMES:
+            return {"ok": False, "error": f"unknown command '{command}'"}
+        done = self.recorder.submit(command, tracer.begin(command, "control"))
+        if not wait:
+            return {"ok": True, "queued": True}
+        ok = await done
+        return {"ok": ok, **self.recorder.status()}
+
+    async def handle_socket(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await self.execute(line.decode(errors="ignore"))
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        except Exception as e:
+            log(f"Error on control connection: {str(e)}")
+        finally:
+            writer.close()
+
+    async def handle_http(self, reader, writer):
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode(errors="ignore").split()
+            path, _, query = parts[1].partition("?") if len(parts) > 1 else ("", "", "")
+            command = path.strip("/").lower()
+            if len(parts) < 2 or parts[0] not in ("GET", "POST"):
+                status, reply = "405 Method Not Allowed", {"ok": False, "error": "use GET or POST"}
+            elif parts[0] == "GET" and command in STATE_COMMANDS:
+                status, reply = "405 Method Not Allowed", {"ok": False, "error": f"use POST for {command}"}
+            else:
+                reply = await self.execute(f"{command} {query}")
+                status = "200 OK" if reply["ok"] or "error" not in reply else "404 Not Found"
+            body = json.dumps(reply).encode() + b"\n"
+            writer.write(
+                f"HTTP/1.0 {status}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        for server in self.servers:
+            server.close()
+        self.servers = []
+        if Config.CONTROL_SOCKET and os.path.exists(Config.CONTROL_SOCKET):
+            try:
+                os.remove(Config.CONTROL_SOCKET)
+            except OSError:
+                pass
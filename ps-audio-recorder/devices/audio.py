@@ -1,40 +1,181 @@
-import subprocess
+import asyncio
+import hashlib
+import json
+import os
 import re
+from dataclasses import asdict
 from utils.logging import log
-from config import Config
+from config import Config, AudioCapabilities
 
-def get_usb_audio_device():
+PREFERRED_FORMATS = ['S24_3LE', 'S24_LE', 'S32_LE', 'S16_LE']
+ASOUND_CARDS = "/proc/asound/cards"
+
+async def run_command(*args):
+    """Run a command without blocking the event loop; returns (stdout, stderr) text."""
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate()
+    return stdout.decode(errors="ignore"), stderr.decode(errors="ignore")
+
+async def get_usb_audio_devices():
+    """Every USB audio card, in card order."""
     try:
-        result = subprocess.run(['arecord', '-l'], capture_output=True, text=True)
-        for line in result.stdout.split('\n'):
+        stdout, _ = await run_command('arecord', '-l')
+        devices = []
+        for line in stdout.split('\n'):
             if 'USB Audio' in line:
                 card_num = line.split(':')[0].split(' ')[1]
-                return f"hw:{card_num},0"
-        return None
+                device = f"hw:{card_num},0"
+                # arecord -l lists a card once per capture subdevice
+                if device not in devices:
+                    devices.append(device)
+        return devices
     except Exception as e:
         log(f"Error detecting USB audio device: {str(e)}")
-        return None
+        return []
+
+async def get_usb_audio_device():
+    devices = await get_usb_audio_devices()
+    return devices[0] if devices else None
+
+def device_label(device):
+    """Short name for a device in filenames and logs, e.g. hw:1,0 -> card1."""
+    match = re.match(r'hw:(\d+)', device or '')
+    if match:
+        return f"card{match.group(1)}"
+    return re.sub(r'[^A-Za-z0-9]+', '-', device).strip('-') if device else "default"
+
+def parse_hw_param(hw_params, name):
+    """Values of one --dump-hw-params field; '[a b]' ranges are returned as their bounds."""
+    match = re.search(rf'^{name}:\s*(.+)$', hw_params, re.MULTILINE)
+    if not match:
+        return []
+    return match.group(1).strip('[]() \t').split()
 
-def get_optimal_settings(device):
+async def get_device_capabilities(device):
     try:
-        result = subprocess.run(['arecord', '--dump-hw-params', '-D', device], capture_output=True, text=True)
-        hw_params = result.stderr
-        
-        formats = re.findall(r'FORMAT: (.+)', hw_params)
-        optimal_format = None
-        if formats:
-            available_formats = formats[0].split()
-            for fmt in ['S24_3LE', 'S24_LE', 'S32_LE', 'S16_LE']:
-                if fmt in available_formats:
-                    optimal_format = fmt
-                    break
-        
-        channels = re.findall(r'CHANNELS: (.+)', hw_params)
-        optimal_channels = Config.CHANNELS
-        if channels and str(optimal_channels) not in channels[0].split():
-            optimal_channels = 2 if '2' in channels[0].split() else 1
-        
-        return optimal_format, optimal_channels
+        _, hw_params = await run_command('arecord', '--dump-hw-params', '-D', device)
+
+        channels = [int(c) for c in parse_hw_param(hw_params, 'CHANNELS')]
+        if len(channels) == 2:
+            channels = list(range(channels[0], channels[1] + 1))
+
+        return AudioCapabilities(
+            device=device,
+            formats=parse_hw_param(hw_params, 'FORMAT'),
+            channels=channels,
+            rates=[int(r) for r in parse_hw_param(hw_params, 'RATE')],
+        )
     except Exception as e:
         log(f"Error getting device settings: {str(e)}")
-        return None, Config.CHANNELS
+        return AudioCapabilities(device=device)
+
+def get_optimal_settings(capabilities):
+    optimal_format = None
+    for fmt in PREFERRED_FORMATS:
+        if fmt in capabilities.formats:
+            optimal_format = fmt
+            break
+
+    optimal_channels = Config.CHANNELS
+    if capabilities.channels and optimal_channels not in capabilities.channels:
+        optimal_channels = 2 if 2 in capabilities.channels else 1
+
+    return optimal_format, optimal_channels
+
+def read_cards_fingerprint():
+    """Hash of /proc/asound/cards; changes whenever a card is added or removed."""
+    try:
+        with open(ASOUND_CARDS, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return ""
+
+class AudioDeviceCache:
+    """Probed capture capabilities of every USB audio card, reused until the
+    set of sound cards changes."""
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file or Config.AUDIO_CACHE_FILE
+        self.devices = None  # list of AudioCapabilities; [default device] when there is no USB card
+        self.fingerprint = None
+
+    async def get(self):
+        """Capabilities of the first device."""
+        return (await self.get_all())[0]
+
+    async def get_all(self, busy=()):
+        """busy: devices held open by a running capture, which can't be probed
+        while it runs; they keep their previous capabilities."""
+        fingerprint = read_cards_fingerprint()
+        if self.devices is not None and fingerprint == self.fingerprint:
+            return self.devices
+
+        devices = None
+        if self.devices is None:
+            devices = self.load(fingerprint)
+        elif self.fingerprint is not None:
+            log("Sound cards changed, probing audio devices again")
+
+        if devices is None:
+            names = await get_usb_audio_devices()
+            if names:
+                previous = {capabilities.device: capabilities for capabilities in self.devices or []}
+                devices = list(await asyncio.gather(*(
+                    self.probe(name, previous.get(name), name in busy) for name in names)))
+            else:
+                devices = [AudioCapabilities(device=None)]
+            if all(capabilities.formats for capabilities in devices if capabilities.device):
+                self.save(fingerprint, devices)
+            else:
+                # Probe again next time instead of keeping an empty result
+                fingerprint = None
+
+        self.devices = devices
+        self.fingerprint = fingerprint
+        return devices
+
+    async def probe(self, device, previous, busy):
+        if previous and previous.formats and busy:
+            return previous
+        capabilities = await get_device_capabilities(device)
+        if not capabilities.formats and previous and previous.formats:
+            log(f"Could not probe {device}, keeping its previous capabilities")
+            return previous
+        return capabilities
+
+    def invalidate(self):
+        self.devices = None
+        self.fingerprint = None
+        try:
+            if os.path.exists(self.cache_file):
+                os.remove(self.cache_file)
+        except Exception as e:
+            log(f"Error clearing audio device cache: {e}")
+
+    def load(self, fingerprint):
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'r') as f:
+                    data = json.load(f)
+                # Caches from before multi-device support have no 'devices' and are probed again
+                if fingerprint and data.get('fingerprint') == fingerprint and data.get('devices'):
+                    devices = [AudioCapabilities(**capabilities) for capabilities in data['devices']]
+                    names = ", ".join(capabilities.device or 'default' for capabilities in devices)
+                    log(f"Loaded cached audio device capabilities: {names}")
+                    return devices
+        except Exception as e:
+            log(f"Error loading audio device cache: {str(e)}")
+        return None
+
+    def save(self, fingerprint, devices):
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(self.cache_file, 'w') as f:
+                json.dump({'fingerprint': fingerprint,
+                           'devices': [asdict(capabilities) for capabilities in devices]}, f)
+        except Exception as e:
+            log(f"Error saving audio device cache: {str(e)}")
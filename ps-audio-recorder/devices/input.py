@@ -1,3 +1,5 @@
+import asyncio
+import os
 import evdev
 from evdev import InputDevice
 import sys
@@ -5,38 +7,173 @@ import termios
 import tty
 from select import select
 from config import Config
+from utils.inotify import Inotify, IN_ATTRIB, IN_CREATE, IN_DELETE
 from utils.logging import log
 
+INPUT_DIR = "/dev/input"
+
 class NonBlockingInput:
     def __init__(self):
         self.old_settings = termios.tcgetattr(sys.stdin)
-    
+
     def __enter__(self):
         tty.setcbreak(sys.stdin.fileno())
         return self
-    
+
     def __exit__(self, type, value, traceback):
         termios.tcsetattr(sys.stdin, termios.TCSADRAIN, self.old_settings)
-    
+
+    def fileno(self):
+        return sys.stdin.fileno()
+
     def check_input(self):
         if select([sys.stdin], [], [], 0)[0]:
             key = sys.stdin.read(1)
             return key
         return None
 
-def find_input_devices():
-    devices = []
+WIRELESS_NAME_HINTS = ('bluetooth', 'bt', 'wireless', 'remote', 'shutter')
+
+def is_wireless_device(device):
+    name = device.name.lower()
+    return any(hint in name for hint in WIRELESS_NAME_HINTS)
+
+def is_trigger_device(device):
     try:
+        key_codes = device.capabilities().get(evdev.ecodes.EV_KEY, [])
+    except OSError:
+        return False
+    return Config.TRIGGER_KEY_CODE in key_codes
+
+class InputDeviceRegistry:
+    """Single owner of the open /dev/input/event* devices.
+
+    Devices are opened once when they appear (initial scan, then inotify
+    hotplug events) and subscribers are told about additions and removals."""
+
+    def __init__(self):
+        self.devices = {}  # path -> InputDevice
+        self.subscribers = []  # (on_added, on_removed)
+        self.inotify = None
+
+    def subscribe(self, on_added=None, on_removed=None):
+        """on_added(device, initial) and on_removed(device) are called on the event loop.
+        Devices already registered are replayed to on_added with initial=True."""
+        self.subscribers.append((on_added, on_removed))
+        if on_added:
+            for device in list(self.devices.values()):
+                self.notify_added(on_added, device, True)
+
+    def start(self):
+        try:
+            self.inotify = Inotify()
+            self.inotify.add_watch(INPUT_DIR, IN_CREATE | IN_ATTRIB | IN_DELETE)
+            self.inotify.start(self.on_inotify_event)
+        except OSError as e:
+            log(f"Could not watch {INPUT_DIR}, hotplugged devices will be missed: {str(e)}")
+            self.inotify = None
         for path in evdev.list_devices():
+            self.add_device(path, initial=True)
+
+    def add_device(self, path, initial=False):
+        if path in self.devices:
+            return
+        try:
+            device = InputDevice(path)
+        except OSError:
+            # Nodes often appear before udev grants access; IN_ATTRIB retries
+            return
+        self.devices[path] = device
+        for on_added, _ in list(self.subscribers):
+            if on_added:
+                self.notify_added(on_added, device, initial)
+
+    def notify_added(self, on_added, device, initial):
+        try:
+            on_added(device, initial)
+        except Exception as e:
+            log(f"Error handling new input device {device.name}: {str(e)}")
+
+    def remove_device(self, path):
+        device = self.devices.pop(path, None)
+        if device is None:
+            return
+        for _, on_removed in list(self.subscribers):
+            if on_removed:
+                try:
+                    on_removed(device)
+                except Exception as e:
+                    log(f"Error handling removed input device {device.name}: {str(e)}")
+        try:
+            device.close()
+        except Exception:
+            pass
+
+    def on_inotify_event(self, directory, mask, name):
+        if not name.startswith("event"):
+            return
+        path = os.path.join(directory, name)
+        if mask & IN_DELETE:
+            self.remove_device(path)
+        else:
+            self.add_device(path)
+
+    def close(self):
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+        self.subscribers = []
+        for device in self.devices.values():
+            try:
+                device.close()
+            except Exception:
+                pass
+        self.devices = {}
+
+class TriggerListener:
+    """Reads TRIGGER_KEY_CODE presses from every capable registered device
+    via loop.add_reader, with no polling."""
+
+    def __init__(self, registry, on_press):
+        self.registry = registry
+        self.on_press = on_press  # called with the evdev key event
+        self.readers = {}  # path -> fd
+        self.loop = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.registry.subscribe(self.on_added, self.on_removed)
+
+    def on_added(self, device, initial):
+        if not is_trigger_device(device):
+            return
+        self.readers[device.path] = device.fd
+        self.loop.add_reader(device.fd, self.on_readable, device)
+        log(f"New input device connected: {device.name}")
+
+    def on_removed(self, device):
+        fd = self.readers.pop(device.path, None)
+        if fd is None:
+            return
+        self.loop.remove_reader(fd)
+        log(f"Input device disconnected: {device.name}")
+
+    def on_readable(self, device):
+        try:
+            for event in device.read():
+                if event.type == evdev.ecodes.EV_KEY and event.code == Config.TRIGGER_KEY_CODE:
+                    if event.value == 1:  # Key press
+                        log(f"Remote button pressed (code: {event.code})")
+                        self.on_press(event)
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.registry.remove_device(device.path)
+
+    def close(self):
+        for fd in self.readers.values():
             try:
-                device = evdev.InputDevice(path)
-                capabilities = device.capabilities()
-                if evdev.ecodes.EV_KEY in capabilities:
-                    key_codes = capabilities[evdev.ecodes.EV_KEY]
-                    if Config.TRIGGER_KEY_CODE in key_codes:
-                        devices.append(device)
-            except:
-                continue
-    except:
-        pass
-    return devices
+                self.loop.remove_reader(fd)
+            except Exception:
+                pass
+        self.readers = {}
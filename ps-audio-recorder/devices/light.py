@@ -61,41 +61,149 @@ async def get_bulb_state(bulb: SmartBulb) -> BulbState:
         log(f"Error getting bulb state: {str(e)}")
         return BulbState(is_on=False, brightness=100, hsv=None)
 
-async def set_recording_state(bulb: SmartBulb, start=True, original_state=None):
-    """On start: turn on + set HSV; On stop: turn off.
-    Returns a placeholder BulbState on start so caller logic that checks for a
-    truthy 'original_state' will still invoke this on stop."""
-    try:
-        if start:
+class LightController:
+    """Drives the recording light from a background task.
+
+    set_recording() only records the wanted state, so the record toggle never
+    waits on the network. Rapid toggles collapse to the latest state, a shadow
+    copy of the bulb state skips redundant update() round trips, and the same
+    bulb object (and its connection) is reused across commands and retries."""
+
+    def __init__(self, bulb: SmartBulb):
+        self.bulb = bulb
+        self.desired = None  # True while recording
+        self.applied = None  # last state confirmed on the bulb; None if unknown
+        self.is_on = None  # shadow copy of the bulb power state
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.on_applied = None  # called with the state once the bulb has confirmed it
+
+    def replace_bulb(self, bulb: SmartBulb):
+        """Switch to a rediscovered bulb and re-apply the wanted state to it."""
+        self.bulb = bulb
+        self.applied = None
+        self.is_on = None
+        if self.desired is not None:
+            self.wakeup.set()
+
+    def set_recording(self, on):
+        self.desired = on
+        self.wakeup.set()
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        failures = 0
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            target = self.desired
+            if target is None or target == self.applied:
+                continue
+            try:
+                await self.apply(target)
+                self.applied = target
+                failures = 0
+                if self.on_applied:
+                    self.on_applied(target)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.applied = None
+                self.is_on = None
+                failures += 1
+                if failures > Config.LIGHT_RETRY_LIMIT:
+                    log(f"Error controlling light, giving up until the next toggle: {str(e)}")
+                    failures = 0
+                    continue
+                delay = min(Config.LIGHT_RETRY_DELAY * 2 ** (failures - 1), Config.LIGHT_RETRY_MAX_DELAY)
+                log(f"Error controlling light, retrying in {delay}s: {str(e)}")
+                try:
+                    # A new request cuts the backoff short
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    self.wakeup.set()
+
+    async def apply(self, on):
+        if self.is_on is None:
+            await self.bulb.update()
+            self.is_on = self.bulb.is_on
+        if on:
             log("Setting recording light ON (no state capture).")
-            if not bulb.is_on:
-                await bulb.turn_on()
+            if not self.is_on:
+                await self.bulb.turn_on()
+                self.is_on = True
                 await asyncio.sleep(Config.POWER_COMMAND_DELAY)
-            await bulb.set_hsv(
+            await self.bulb.set_hsv(
                 Config.RECORDING_HUE,
                 Config.RECORDING_SATURATION,
                 Config.RECORDING_BRIGHTNESS
             )
             log(f"Recording light set: hue={Config.RECORDING_HUE}, sat={Config.RECORDING_SATURATION}, val={Config.RECORDING_BRIGHTNESS}")
-            # Return placeholder so stopping logic in caller still triggers
-            return BulbState(is_on=True, brightness=Config.RECORDING_BRIGHTNESS,
-                             hsv=HSV(Config.RECORDING_HUE, Config.RECORDING_SATURATION, Config.RECORDING_BRIGHTNESS))
         else:
             log("Turning recording light OFF.")
+            if self.is_on:
+                await self.bulb.turn_off()
+                self.is_on = False
+            log("Recording light turned off.")
+
+    async def close(self, timeout=3):
+        """Give a pending command a moment to reach the bulb, then stop the task."""
+        if self.task is None:
+            return
+        try:
+            deadline = asyncio.get_running_loop().time() + timeout
+            while self.desired is not None and self.applied != self.desired:
+                if asyncio.get_running_loop().time() >= deadline:
+                    break
+                await asyncio.sleep(0.1)
+        finally:
+            self.task.cancel()
             try:
-                await bulb.update()
-            except Exception:
+                await self.task
+            except asyncio.CancelledError:
                 pass
+            self.task = None
+
+def is_recording_bulb(dev):
+    return bool(dev.alias) and dev.alias.lower() == Config.BULB_NAME.lower()
+
+async def discover_bulb_address(timeout):
+    """Broadcast discovery that updates responders concurrently (bounded by
+    BULB_DISCOVERY_CONCURRENCY) and returns as soon as the alias matches."""
+    match = asyncio.get_running_loop().create_future()
+    limit = asyncio.Semaphore(Config.BULB_DISCOVERY_CONCURRENCY)
+    checks = set()
+
+    async def check(dev):
+        async with limit:
+            if match.done():
+                return
             try:
-                await bulb.turn_off()
-                await asyncio.sleep(0.1)
-                log("Recording light turned off.")
-            except Exception as off_err:
-                log(f"Failed turning off recording light: {off_err}")
-            return None
-    except Exception as e:
-        log(f"Error controlling light: {str(e)}")
-    return None
+                await dev.update()
+                log(f"Found device: {dev.alias} at {dev.host}")
+                if is_recording_bulb(dev) and not match.done():
+                    match.set_result(dev.host)
+            except Exception as dev_err:
+                log(f"Skipping device at {dev.host} due to error: {dev_err}")
+
+    async def on_discovered(dev):
+        checks.add(asyncio.create_task(check(dev)))
+
+    discovery = asyncio.create_task(Discover.discover(timeout=timeout, on_discovered=on_discovered))
+    try:
+        await asyncio.wait({discovery, match}, return_when=asyncio.FIRST_COMPLETED)
+        if discovery.done() and discovery.exception():
+            log(f"Error during bulb discovery: {discovery.exception()}")
+        # Discovery window closed; let in-flight updates finish unless one already matched
+        while not match.done() and not all(task.done() for task in checks):
+            await asyncio.wait({match, *checks}, return_when=asyncio.FIRST_COMPLETED)
+        return match.result() if match.done() else None
+    finally:
+        for task in (discovery, *checks):
+            task.cancel()
+        if not match.done():
+            match.cancel()
 
 async def find_kasa_bulb():
     """Find the dedicated recording bulb by alias with robust error handling."""
@@ -105,7 +213,7 @@ async def find_kasa_bulb():
             log(f"Attempting to connect to cached bulb IP: {last_ip}")
             bulb = SmartBulb(last_ip)
             await bulb.update()
-            if bulb.alias and bulb.alias.lower() == Config.BULB_NAME.lower():
+            if is_recording_bulb(bulb):
                 log(f"Successfully connected to cached bulb: {bulb.alias}")
                 return bulb
             else:
@@ -119,20 +227,13 @@ async def find_kasa_bulb():
     try:
         timeout = getattr(Config, "BULB_DISCOVERY_TIMEOUT", 8)
         log(f"Starting bulb discovery (timeout={timeout}s)...")
-        devices = await Discover.discover(timeout=timeout)
-        # Iterate devices safely
-        for addr, dev in devices.items():
-            try:
-                await dev.update()
-                log(f"Found device: {dev.alias} at {addr}")
-                if dev.alias and dev.alias.lower() == Config.BULB_NAME.lower():
-                    save_bulb_info(addr)
-                    bulb = SmartBulb(addr)
-                    await bulb.update()
-                    log(f"Found and cached matching bulb: {bulb.alias}")
-                    return bulb
-            except Exception as dev_err:
-                log(f"Skipping device at {addr} due to error: {dev_err}")
+        addr = await discover_bulb_address(timeout)
+        if addr:
+            save_bulb_info(addr)
+            bulb = SmartBulb(addr)
+            await bulb.update()
+            log(f"Found and cached matching bulb: {bulb.alias}")
+            return bulb
     except Exception as e:
         log(f"Error during bulb discovery: {e}")
 
@@ -157,4 +258,47 @@ async def test_bulb_connection(bulb):
         return True
     except Exception as e:
         log(f"Bulb connection test failed: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+async def revalidate_bulb(host):
+    """Cheap check that the bulb still answers at host under the expected alias."""
+    try:
+        probe = SmartBulb(host)
+        await asyncio.wait_for(probe.update(), timeout=5)
+        if hasattr(probe, "disconnect"):
+            await probe.disconnect()
+        return is_recording_bulb(probe)
+    except Exception:
+        return False
+
+async def watch_kasa_bulb(on_bulb):
+    """Find the recording bulb in the background and keep the cached IP fresh.
+
+    on_bulb(bulb) is called whenever a working bulb is found. The bulb is
+    revalidated every BULB_REVALIDATE_INTERVAL seconds and rediscovered if
+    it moved (e.g. new DHCP lease), so the next start never waits on a full
+    discovery."""
+    bulb = None
+    while True:
+        if bulb is None:
+            try:
+                bulb = await find_kasa_bulb()
+                if bulb:
+                    if await test_bulb_connection(bulb):
+                        log(f"Successfully connected to {Config.BULB_NAME}")
+                        on_bulb(bulb)
+                    else:
+                        log("Failed to control bulb, continuing without light control")
+                        bulb = None
+                else:
+                    log("No Kasa bulb found, continuing without light control")
+            except Exception as e:
+                log(f"Error setting up Kasa bulb: {str(e)}")
+                bulb = None
+
+        await asyncio.sleep(Config.BULB_REVALIDATE_INTERVAL)
+
+        if bulb is not None and not await revalidate_bulb(bulb.host):
+            log(f"Bulb at {bulb.host} stopped responding as '{Config.BULB_NAME}', rediscovering")
+            clear_cached_bulb_ip()
+            bulb = None
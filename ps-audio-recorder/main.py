@@ -1,229 +1,204 @@
-import asyncio
-from select import select
 import time
+IMPORTS_STARTED = time.monotonic()  # before the other imports, for the startup profile
+
+import asyncio
+import importlib
 import os
 import sys
 from contextlib import nullcontext
-import evdev
-from evdev import ecodes
 
 from config import Config
-from devices.input import NonBlockingInput, find_input_devices
-from devices.light import find_kasa_bulb, test_bulb_connection
+from devices.input import NonBlockingInput, InputDeviceRegistry, TriggerListener, is_wireless_device
 from utils.logging import log
+from utils.metrics import start_metrics_server
+from utils.profile import startup
+from utils.trace import tracer
+from pipeline.health import PipelineMonitor
+from pipeline.levels import level_meter_available
 from recorder import Recorder
+from control import ControlServer
 
 # Skip keyboard input if running as a service
 def is_running_as_service():
     return not sys.stdout.isatty()
 
-async def detect_bt_reconnection(recorder):
+def show_level(rms_db, peak_db):
+    """One-line level meter for interactive runs, redrawn in place."""
+    width = 30
+    filled = max(0, min(width, int((rms_db + 60) / 60 * width)))
+    clip = " CLIP" if peak_db >= Config.CLIP_THRESHOLD_DB else ""
+    sys.stdout.write(f"\r[{'#' * filled}{'.' * (width - filled)}] {rms_db:6.1f} dB  peak {peak_db:6.1f} dB{clip}\x1b[K")
+    sys.stdout.flush()
+
+class ReconnectMonitor:
     """
-    Monitor bluetooth devices for reconnection events.
-    When a device reconnects, only stop recording if already recording.
+    Watch bluetooth devices in the input registry for reconnection events.
+    When a device that had disconnected comes back, only stop recording if already recording.
     """
-    device_states = {}  # Path -> was_connected state
-    reconnection_cooldown = 0
-    first_run = True
-    
-    log("Starting Bluetooth reconnection monitor for stopping recordings")
-    
-    while True:
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.connected = {}  # uniq (BT address) or name -> paths of its event nodes
+        self.disconnected = set()  # keys whose last event node has gone away
+        self.reconnection_cooldown = 0
+        self.stop_task = None
+
+    def start(self, registry):
+        log("Starting Bluetooth reconnection monitor for stopping recordings")
+        registry.subscribe(self.on_added, self.on_removed)
+        log(f"Initially monitoring {len(self.connected)} bluetooth devices")
+
+    def on_added(self, device, initial):
+        if not is_wireless_device(device):
+            return
+        key = device.uniq or device.name
+        if initial and key not in self.connected:
+            log(f"Found bluetooth device to monitor: {device.name}")
+        self.connected.setdefault(key, set()).add(device.path)
+        # A new device, or another event node of one that is connected (e.g. keyboard
+        # plus consumer control), is not a reconnect
+        if initial or key not in self.disconnected:
+            return
+        self.disconnected.discard(key)
+
+        # Only trigger to STOP recording if currently recording
+        # This avoids starting recording with a reconnection
+        current_time = time.time()
+        if self.recorder.is_recording() and current_time > self.reconnection_cooldown:
+            log("Bluetooth device reconnected - stopping recording")
+            self.reconnection_cooldown = current_time + 3  # 3 second cooldown
+            self.stop_task = asyncio.create_task(self.stop_recording())
+
+    def on_removed(self, device):
+        key = device.uniq or device.name
+        paths = self.connected.get(key)
+        if paths is None:
+            return
+        paths.discard(device.path)
+        if not paths:
+            del self.connected[key]
+            self.disconnected.add(key)
+
+    async def stop_recording(self):
         try:
-            current_time = time.time()
-            
-            # Discover input devices that might be bluetooth/wireless
-            all_input_paths = set(evdev.list_devices())
-            
-            # First run - just populate the initial state without triggering anything
-            if first_run:
-                for path in all_input_paths:
-                    try:
-                        device = evdev.InputDevice(path)
-                        name = device.name.lower()
-                        
-                        # Check if it's a bluetooth/wireless device by name
-                        if ('bluetooth' in name or 'bt' in name or 
-                            'wireless' in name or 'remote' in name or
-                            'shutter' in name):
-                            device_states[path] = True
-                            log(f"Found bluetooth device to monitor: {device.name}")
-                        
-                        # Close the device
-                        device.close()
-                    except Exception:
-                        pass
-                
-                first_run = False
-                log(f"Initially monitoring {len(device_states)} bluetooth devices")
-                await asyncio.sleep(2)
-                continue
-            
-            # Check for devices that disappeared (quietly, no logging)
-            for path in list(device_states.keys()):
-                if path not in all_input_paths:
-                    device_states[path] = False
-            
-            # Check for devices that reappeared
-            for path in all_input_paths:
-                # Device exists in our states but was previously disconnected
-                if path in device_states and not device_states[path]:
-                    device_states[path] = True
-                    
-                    # Only trigger to STOP recording if currently recording
-                    # This avoids starting recording with a reconnection
-                    if recorder.is_recording and current_time > reconnection_cooldown:
-                        log("Bluetooth device reconnected - stopping recording")
-                        await asyncio.sleep(0.5)  # Brief delay to allow connection to stabilize
-                        await recorder.stop()  # Only stop, don't toggle
-                        reconnection_cooldown = current_time + 3  # 3 second cooldown
-                
-                # New bluetooth device we haven't seen before (quiet monitoring)
-                elif path not in device_states:
-                    try:
-                        device = evdev.InputDevice(path)
-                        name = device.name.lower()
-                        
-                        # Check if it's a bluetooth/wireless device
-                        if ('bluetooth' in name or 'bt' in name or 
-                            'wireless' in name or 'remote' in name or
-                            'shutter' in name):
-                            device_states[path] = True
-                        
-                        # Close the device
-                        device.close()
-                    except Exception:
-                        pass
-            
+            await asyncio.sleep(0.5)  # Brief delay to allow connection to stabilize
+            self.recorder.submit("stop", tracer.begin("stop", "reconnect"))  # Only stop, don't toggle
         except Exception as e:
             log(f"Error in bluetooth reconnection monitor: {str(e)}")
-            
-        await asyncio.sleep(1)
+
+    def close(self):
+        if self.stop_task:
+            self.stop_task.cancel()
+
+async def finish_startup(recorder):
+    """Start-up work that can happen after "Ready to record": warming up
+    optional imports and finding the bulb. Slow imports run in a thread so
+    button presses are handled meanwhile."""
+    if Config.LEVEL_METER:
+        with startup.phase("numpy_import"):
+            if not await asyncio.to_thread(level_meter_available):
+                log("NumPy is not installed; level metering and silence auto-stop are disabled")
+    if not Config.LIGHT_ENABLED:
+        startup.report()
+        return
+
+    with startup.phase("kasa_import"):
+        light = await asyncio.to_thread(importlib.import_module, "devices.light")
+    discovery_started = time.monotonic()
+    # Report even if the bulb never shows up
+    asyncio.get_running_loop().call_later(Config.BULB_DISCOVERY_TIMEOUT * 2, startup.report)
+
+    def on_bulb(bulb):
+        if "bulb_discovery" not in startup.phases:
+            startup.record("bulb_discovery", time.monotonic() - discovery_started)
+            startup.report()
+        recorder.set_light(bulb)
+
+    # Find the Kasa bulb in the background and attach it when it answers
+    await light.watch_kasa_bulb(on_bulb)
 
 async def main():
-    # Initialize Kasa bulb with better error handling
-    try:
-        kasa_dev = await find_kasa_bulb()
-        if kasa_dev:
-            if await test_bulb_connection(kasa_dev):
-                log(f"Successfully connected to {Config.BULB_NAME}")
-            else:
-                log("Failed to control bulb, continuing without light control")
-                kasa_dev = None
-        else:
-            log("No Kasa bulb found, continuing without light control")
-    except Exception as e:
-        log(f"Error setting up Kasa bulb: {str(e)}")
-        kasa_dev = None
-    
-    # Initialize recorder
-    recorder = Recorder(kasa_dev)
-    
-    # Keep track of input devices
-    current_devices = {}
-    
-    # Start bluetooth reconnection monitor as a background task
-    bt_monitor_task = asyncio.create_task(detect_bt_reconnection(recorder))
-    
-    log("Ready to record. Waiting for wireless button input...")
+    startup.record("imports", time.monotonic() - IMPORTS_STARTED)
+
+    # Input and recorder come up first; the bulb is attached whenever it answers
+    # Button presses and control commands queue on the recorder and are handled one at a time
+    recorder = Recorder()
+    input_devices = InputDeviceRegistry()
+    # The evdev timestamp starts each toggle's latency trace
+    trigger_listener = TriggerListener(input_devices, lambda event: recorder.submit(
+        "toggle", tracer.begin("toggle", "button", event.timestamp())))
+    with startup.phase("input_devices"):
+        input_devices.start()
+        trigger_listener.start()
+
+    await recorder.open()
+    reconnect_monitor = ReconnectMonitor(recorder)
+
+    # Pipeline health for local scraping
+    metrics_servers = await start_metrics_server()
+    health = PipelineMonitor(recorder)
+    health.start()
+
+    control = ControlServer(recorder)
+    await control.start()
+
+    background_task = asyncio.create_task(finish_startup(recorder))
     
     try:
+        reconnect_monitor.start(input_devices)
+        startup.mark_ready()
+        log("Ready to record. Waiting for wireless button input...")
+
+        if "--profile-startup" in sys.argv:
+            # Profile run: wait for the background phases, report, and exit
+            await asyncio.wait_for(startup.reported.wait(), timeout=Config.BULB_DISCOVERY_TIMEOUT * 2 + 30)
+            return
+
         # Only set up keyboard input if not running as a service
         keyboard = None
         if not is_running_as_service():
             keyboard = NonBlockingInput()
+            recorder.level_listener = show_level
             log("Keyboard input enabled. Press SPACE to start/stop recording.")
 
         with keyboard if keyboard else nullcontext():
-            while True:
-                # Check for new input devices
-                try:
-                    for device in find_input_devices():
-                        if device.path not in current_devices:
-                            log(f"New input device connected: {device.name}")
-                            current_devices[device.path] = device
-                except Exception as e:
-                    log(f"Error finding input devices: {str(e)}")
-                
-                # Check for disconnected devices
-                disconnected = []
-                for path, device in list(current_devices.items()):
-                    try:
-                        _ = device.name
-                    except:
-                        disconnected.append(path)
-                        try:
-                            device.close()
-                        except:
-                            pass
-                
-                for path in disconnected:
-                    log(f"Input device disconnected: {current_devices[path].name}")
-                    del current_devices[path]
-                
-                # Handle input devices
-                if current_devices:
-                    try:
-                        r, _, _ = select(current_devices.values(), [], [], 0)
-                    except (OSError, IOError):  # This will catch disconnected devices
-                        # Clear invalid devices
-                        for path in list(current_devices.keys()):
-                            try:
-                                current_devices[path].close()
-                            except:
-                                pass
-                            log(f"Removed invalid device at {path}")
-                            del current_devices[path]
-                        continue
-                        
-                    for ready_device in r:
-                        try:
-                            for event in ready_device.read():
-                                if event.type == ecodes.EV_KEY and event.code == Config.TRIGGER_KEY_CODE:
-                                    if event.value == 1:  # Key press
-                                        log(f"Remote button pressed (code: {event.code})")
-                                        await recorder.toggle()
-                        except (OSError, IOError):
-                            # Remove the disconnected device
-                            for path, device in list(current_devices.items()):
-                                if device == ready_device:
-                                    try:
-                                        device.close()
-                                    except:
-                                        pass
-                                    log(f"Removed disconnected device at {path}")
-                                    del current_devices[path]
-                                    break
-                
-                # Handle keyboard input only if enabled
-                if keyboard:
-                    key = keyboard.check_input()
-                    if key == ' ':
+            if keyboard:
+                def on_key():
+                    if keyboard.check_input() == ' ':
                         log("Spacebar pressed")
-                        await recorder.toggle()
-                
-                await asyncio.sleep(0.1)
+                        recorder.submit("toggle", tracer.begin("toggle", "keyboard"))
+                asyncio.get_running_loop().add_reader(keyboard.fileno(), on_key)
+
+            try:
+                await recorder.run()
+            finally:
+                if keyboard:
+                    asyncio.get_running_loop().remove_reader(keyboard.fileno())
 
     except KeyboardInterrupt:
         log("KeyboardInterrupt received")
     except Exception as e:
         log(f"An error occurred: {str(e)}")
     finally:
-        # Cancel the bluetooth monitor task
-        bt_monitor_task.cancel()
+        # Stop the bluetooth reconnection monitor and bulb discovery
+        reconnect_monitor.close()
+        background_task.cancel()
+        control.close()
+        health.close()
+        for server in metrics_servers:
+            server.close()
             
-        # Stop recording if active
-        await recorder.stop()
+        # Stop recording if active and release the capture device
+        await recorder.close()
         
         # Close all input devices
-        for device in current_devices.values():
-            try:
-                device.close()
-            except:
-                pass
-                
+        trigger_listener.close()
+        input_devices.close()
+        
         log("Script terminated")
 
 if __name__ == "__main__":
     log("Script started")
+    if "--profile-startup" in sys.argv:
+        Config.STARTUP_PROFILE = True
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,241 @@
+import asyncio
+import re
+import time
+
+from utils.logging import log
+from utils.metrics import metrics
+from utils.sched import apply_policy
+from config import Config
+
+# Bytes per sample for the formats get_optimal_settings can pick
+SAMPLE_WIDTHS = {
+    "S16_LE": 2,
+    "S24_3LE": 3,
+    "S24_LE": 4,
+    "S32_LE": 4,
+}
+
+CHUNK_BYTES = 64 * 1024
+
+OVERRUN_PATTERN = re.compile(rb"overrun!!! \(at least ([\d.]+) ms long\)")
+
+CAPTURE_BYTES = metrics.counter("recorder_capture_bytes_total", "PCM bytes read from arecord")
+SINK_BYTES = metrics.counter("recorder_sink_bytes_total", "PCM bytes handed to the recording pipeline")
+OVERRUNS = metrics.counter("recorder_capture_overruns_total", "Overruns reported by arecord")
+OVERRUN_SECONDS = metrics.histogram("recorder_capture_overrun_seconds", "Reported length of arecord overruns")
+CAPTURE_STDERR = metrics.counter("recorder_capture_stderr_lines_total", "Other lines arecord wrote to stderr")
+
+def frame_size(audio_format, channels):
+    return SAMPLE_WIDTHS.get(audio_format, 4) * channels
+
+async def read_wav_header(stream):
+    """Read a WAV header from stream up to and including the data chunk header."""
+    header = await stream.readexactly(12)
+    if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        raise ValueError("capture stream is not WAV")
+    while True:
+        chunk = await stream.readexactly(8)
+        header += chunk
+        size = int.from_bytes(chunk[4:8], "little")
+        if chunk[:4] == b"data":
+            return header
+        header += await stream.readexactly(size + (size & 1))
+
+class PreRollBuffer:
+    """Fixed-size ring buffer holding the most recent PCM bytes."""
+
+    def __init__(self, capacity, frame_bytes):
+        self.frame_bytes = frame_bytes
+        self.capacity = max(frame_bytes, capacity - capacity % frame_bytes)
+        self._buf = bytearray(self.capacity)
+        self._pos = 0
+        self._filled = 0
+
+    def write(self, data):
+        n = len(data)
+        if n >= self.capacity:
+            self._buf[:] = memoryview(data)[n - self.capacity:]
+            self._pos = 0
+            self._filled = self.capacity
+            return
+        end = self._pos + n
+        if end <= self.capacity:
+            self._buf[self._pos:end] = data
+        else:
+            first = self.capacity - self._pos
+            self._buf[self._pos:] = memoryview(data)[:first]
+            self._buf[:n - first] = memoryview(data)[first:]
+        self._pos = end % self.capacity
+        self._filled = min(self.capacity, self._filled + n)
+
+    def snapshot(self, end_offset):
+        """Return buffered audio oldest-first, trimmed to start on a frame boundary.
+
+        end_offset is the stream offset just past the newest buffered byte."""
+        if self._filled < self.capacity:
+            data = bytes(self._buf[:self._filled])
+        else:
+            data = bytes(self._buf[self._pos:] + self._buf[:self._pos])
+        skip = (-(end_offset - len(data))) % self.frame_bytes
+        return data[skip:]
+
+    def clear(self):
+        self._pos = 0
+        self._filled = 0
+
+class CaptureStream:
+    """Long-running arecord process. PCM goes into the pre-roll buffer while
+    idle and into the attached sink while recording."""
+
+    def __init__(self, device, audio_format, channels, preroll_seconds=0, cpus=(None, None)):
+        self.device = device
+        self.cpus, self.encoder_cpus = cpus  # CPU sets for arecord and for the encoders fed from it
+        self.audio_format = audio_format or Config.AUDIO_FORMAT
+        self.channels = channels
+        self.frame_bytes = frame_size(self.audio_format, channels)
+        self.bytes_per_second = Config.SAMPLE_RATE * self.frame_bytes
+        self.preroll = None
+        if preroll_seconds > 0:
+            self.preroll = PreRollBuffer(int(preroll_seconds * self.bytes_per_second), self.frame_bytes)
+        self.process = None
+        self.wav_header = None
+        self.offset = 0  # PCM bytes read since the WAV header
+        self.read_ns = None  # wall clock (time.time_ns) when the byte at offset was read
+        self._sink = None
+        self._skip = 0
+        self._pending = b""  # pre-roll audio queued ahead of the next live chunk
+        self._reader_task = None
+        self._stderr_task = None
+        self.overruns = 0
+        self.on_overrun = None  # called with the overrun length in ms
+        self.tap = None  # called with every block delivered to the sink (e.g. the level meter)
+        self.delivered = asyncio.Event()  # set once the attached sink has received PCM
+        self.spawned_at = None  # time.time() when arecord was started
+        self.delivered_at = None  # time.time() of the first PCM delivered to the current sink
+
+    def command(self):
+        command = ["arecord", "-r", str(Config.SAMPLE_RATE), "-t", "wav"]
+        if self.device:
+            command.extend(["-D", self.device])
+        command.extend(["-f", self.audio_format, "-c", str(self.channels)])
+        return command
+
+    async def start(self):
+        log(f"Starting capture: {' '.join(self.command())}")
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command(),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self.spawned_at = time.time()
+        apply_policy(self.process.pid, "capture", self.cpus)
+        try:
+            self.wav_header = await asyncio.wait_for(read_wav_header(self.process.stdout), timeout=5)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+            err = ""
+            if self.process.returncode is not None:
+                err = (await self.process.stderr.read()).decode(errors="ignore").strip()
+            await self.stop()
+            raise RuntimeError(f"arecord failed to start: {err or e}")
+        self._reader_task = asyncio.create_task(self._pump())
+        self._stderr_task = asyncio.create_task(self._watch_stderr())
+
+    def is_running(self):
+        return self.process is not None and self.process.returncode is None
+
+    def attach(self, sink):
+        """Route PCM into sink (an object with an async write(data)), starting with
+        any pre-roll audio. Returns the number of pre-roll bytes queued."""
+        pre = b""
+        if self.preroll:
+            pre = self.preroll.snapshot(self.offset)
+            self.preroll.clear()
+        self._skip = 0 if pre else (-self.offset) % self.frame_bytes
+        self._pending = pre
+        self.delivered.clear()
+        self._sink = sink
+        return len(pre)
+
+    def detach(self):
+        self._sink = None
+        self._pending = b""
+
+    async def _pump(self):
+        stdout = self.process.stdout
+        try:
+            while True:
+                data = await stdout.read(CHUNK_BYTES)
+                if not data:
+                    break
+                self.offset += len(data)
+                self.read_ns = time.time_ns()
+                CAPTURE_BYTES.inc(len(data))
+                sink = self._sink
+                if sink is None:
+                    if self.preroll:
+                        self.preroll.write(data)
+                    continue
+                if self._skip:
+                    skip, self._skip = min(self._skip, len(data)), max(0, self._skip - len(data))
+                    data = data[skip:]
+                if self._pending:
+                    data, self._pending = self._pending + data, b""
+                try:
+                    await sink.write(data)
+                    SINK_BYTES.inc(len(data))
+                    if not self.delivered.is_set():
+                        self.delivered_at = time.time()
+                        self.delivered.set()
+                    if self.tap:
+                        self.tap(data)
+                except (BrokenPipeError, ConnectionResetError) as e:
+                    log(f"Encoder input closed: {str(e)}")
+                    if self._sink is sink:
+                        self._sink = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log(f"Error reading capture stream: {str(e)}")
+        log("Capture stream ended")
+
+    async def _watch_stderr(self):
+        """Drain arecord's stderr so it never blocks, and report overruns."""
+        try:
+            async for line in self.process.stderr:
+                match = OVERRUN_PATTERN.search(line)
+                if match:
+                    self.overruns += 1
+                    milliseconds = float(match.group(1))
+                    OVERRUNS.inc()
+                    OVERRUN_SECONDS.observe(milliseconds / 1000)
+                    log(f"Capture overrun of at least {milliseconds}ms", event="capture_overrun", ms=milliseconds)
+                    if self.on_overrun:
+                        self.on_overrun(milliseconds)
+                elif line.strip():
+                    CAPTURE_STDERR.inc()
+                    log(f"arecord: {line.decode(errors='ignore').strip()}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log(f"Error reading arecord stderr: {str(e)}")
+
+    async def stop(self):
+        self._sink = None
+        if self.process and self.process.returncode is None:
+            try:
+                self.process.terminate()
+                await asyncio.wait_for(self.process.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+        for task in (self._reader_task, self._stderr_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._reader_task = None
+        self._stderr_task = None
+        self.process = None
@@ -0,0 +1,91 @@
+import os
+import struct
+
+from utils.logging import log
+from config import Config
+
+class Encoder:
+    """Encoder backend: a command that reads WAV on stdin and writes the encoded file to stdout."""
+    name = None
+    extension = None
+
+    def command(self):
+        raise NotImplementedError
+
+    def finalize(self, filename, header_bytes):
+        """Fix up a finished file; header_bytes is the length of the WAV header written first."""
+        pass
+
+    def estimated_rate(self, pcm_rate):
+        """Upper estimate of output bytes per second for pcm_rate bytes per second of input."""
+        return pcm_rate
+
+class LameEncoder(Encoder):
+    extension = "mp3"
+
+    def __init__(self, name, quality_args, max_kbps):
+        self.name = name
+        self.quality_args = quality_args
+        self.max_kbps = max_kbps  # worst case for the VBR preset
+
+    def command(self):
+        return ["lame", "--ignorelength", *self.quality_args, "--silent", "-", "-"]
+
+    def estimated_rate(self, pcm_rate):
+        return self.max_kbps * 1000 // 8
+
+class FlacEncoder(Encoder):
+    name = "flac"
+    extension = "flac"
+
+    def command(self):
+        # Fastest compression level; arecord's streaming header has placeholder sizes
+        return ["flac", "-0", "--silent", "--ignore-chunk-sizes", "--stdout", "-"]
+
+    def estimated_rate(self, pcm_rate):
+        # -0 rarely does better than ~60% on live audio; 32-bit input has padding to squeeze out
+        return int(pcm_rate * 0.75)
+
+class WavEncoder(Encoder):
+    """Lossless passthrough of the capture stream."""
+    name = "wav"
+    extension = "wav"
+
+    def command(self):
+        return ["cat"]
+
+    def finalize(self, filename, header_bytes):
+        # Replace the streaming placeholders with the real RIFF and data sizes
+        try:
+            size = os.path.getsize(filename)
+            if size < header_bytes:
+                return
+            with open(filename, "r+b") as f:
+                f.seek(4)
+                f.write(struct.pack("<I", min(size - 8, 0xFFFFFFFF)))
+                f.seek(header_bytes - 4)
+                f.write(struct.pack("<I", min(size - header_bytes, 0xFFFFFFFF)))
+        except Exception as e:
+            log(f"Error finalizing WAV header for {filename}: {str(e)}")
+
+ENCODERS = {
+    "mp3-extreme": LameEncoder("mp3-extreme", ["--preset", "extreme"], 320),
+    "mp3-v2": LameEncoder("mp3-v2", ["-V", "2"], 256),
+    "mp3-v5": LameEncoder("mp3-v5", ["-V", "5", "-q", "7"], 160),
+    "flac": FlacEncoder(),
+    "wav": WavEncoder(),
+}
+
+def get_encoder(name):
+    encoder = ENCODERS.get(name)
+    if encoder is None:
+        log(f"Unknown encoder '{name}', using mp3-extreme")
+        encoder = ENCODERS["mp3-extreme"]
+    return encoder
+
+def cheaper_encoder(encoder):
+    """Next entry of ENCODER_FALLBACKS after encoder, or None when there is nothing cheaper."""
+    chain = [name for name in Config.ENCODER_FALLBACKS if name in ENCODERS]
+    if encoder.name in chain:
+        chain = chain[chain.index(encoder.name) + 1:]
+    return ENCODERS[chain[0]] if chain else None
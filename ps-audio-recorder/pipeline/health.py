@@ -0,0 +1,100 @@
+import asyncio
+import os
+import time
+
+from utils.logging import log
+from utils.metrics import metrics
+from config import Config
+from devices.audio import device_label
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+PROCESS_CPU = metrics.gauge("recorder_process_cpu_seconds", "CPU time used by a pipeline process")
+PROCESS_CPU_RATIO = metrics.gauge("recorder_process_cpu_ratio", "CPU share of a pipeline process over the last sample")
+PROCESS_RSS = metrics.gauge("recorder_process_rss_bytes", "Resident memory of a pipeline process")
+OUTPUT_BYTES = metrics.gauge("recorder_output_file_bytes", "Size of the segment currently being written")
+OUTPUT_GROWTH = metrics.gauge("recorder_output_bytes_per_second", "Growth rate of the current segment")
+RECORDING = metrics.gauge("recorder_recording", "1 while a recording is active")
+
+def read_proc_stat(pid):
+    """(cpu_seconds, rss_bytes) for pid from /proc/<pid>/stat."""
+    with open(f"/proc/{pid}/stat", "r") as f:
+        data = f.read()
+    # The command name may contain spaces; fields restart after the closing paren
+    fields = data[data.rindex(")") + 2:].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    rss_bytes = int(fields[21]) * PAGE_SIZE
+    return cpu_seconds, rss_bytes
+
+class PipelineMonitor:
+    """Samples the capture and encoder processes every METRICS_SAMPLE_INTERVAL seconds."""
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.task = None
+        self.previous = {}  # (role, device) -> (pid, cpu_seconds, monotonic time)
+        self.previous_output = {}  # device -> (filename, size, monotonic time)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                log(f"Error sampling pipeline metrics: {str(e)}")
+            await asyncio.sleep(Config.METRICS_SAMPLE_INTERVAL)
+
+    def pipeline_processes(self):
+        """{(role, device label): process} for every running pipeline."""
+        recorder = self.recorder
+        processes = {}
+        for capture in recorder.captures:
+            if capture.process:
+                processes[("capture", device_label(capture.device))] = capture.process
+        for take in recorder.takes:
+            if take.process:
+                processes[("encoder", device_label(take.capture.device))] = take.process
+        return processes
+
+    def sample(self):
+        now = time.monotonic()
+        RECORDING.set(1 if self.recorder.recording else 0)
+        for (role, device), process in self.pipeline_processes().items():
+            if process.returncode is not None:
+                continue
+            try:
+                cpu_seconds, rss_bytes = read_proc_stat(process.pid)
+            except OSError:
+                continue
+            PROCESS_CPU.set(cpu_seconds, process=role, device=device)
+            PROCESS_RSS.set(rss_bytes, process=role, device=device)
+            previous = self.previous.get((role, device))
+            if previous and previous[0] == process.pid and now > previous[2]:
+                PROCESS_CPU_RATIO.set(round((cpu_seconds - previous[1]) / (now - previous[2]), 4),
+                                      process=role, device=device)
+            self.previous[(role, device)] = (process.pid, cpu_seconds, now)
+
+        outputs = {}
+        for take in self.recorder.takes:
+            if take.part_filename:
+                outputs[device_label(take.capture.device)] = take.part_filename
+        for device in set(self.previous_output) - set(outputs):
+            OUTPUT_GROWTH.set(0, device=device)
+            del self.previous_output[device]
+        for device, part_filename in outputs.items():
+            try:
+                size = os.path.getsize(part_filename)
+            except OSError:
+                continue
+            OUTPUT_BYTES.set(size, device=device)
+            previous = self.previous_output.get(device)
+            if previous and previous[0] == part_filename and now > previous[2]:
+                OUTPUT_GROWTH.set(round((size - previous[1]) / (now - previous[2]), 1), device=device)
+            self.previous_output[device] = (part_filename, size, now)
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
@@ -0,0 +1,150 @@
+import asyncio
+import math
+import time
+
+from utils.logging import log
+from utils.metrics import metrics
+from config import Config
+from pipeline.capture import frame_size
+
+np = None  # imported on first use; loading numpy takes a while on a Pi Zero
+
+LEVEL_RMS = metrics.gauge("recorder_level_rms_dbfs", "RMS level of the last metering window")
+LEVEL_PEAK = metrics.gauge("recorder_level_peak_dbfs", "Peak level of the last metering window")
+CLIPPED_WINDOWS = metrics.counter("recorder_clipped_windows_total", "Metering windows that reached the clip threshold")
+DROPPED_BLOCKS = metrics.counter("recorder_level_dropped_blocks_total", "PCM blocks the level meter skipped to keep up")
+
+SILENCE_DB = -120.0
+
+def to_dbfs(value):
+    return 20 * math.log10(value) if value > 0 else SILENCE_DB
+
+def decode_pcm(data, audio_format, channels):
+    """PCM bytes -> float32 array of shape (frames, channels) in [-1, 1)."""
+    if audio_format == "S16_LE":
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+    elif audio_format == "S24_3LE":
+        packed = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        # Assemble into the top three bytes so the sign comes out right
+        samples = ((packed[:, 0] << 8) | (packed[:, 1] << 16) | (packed[:, 2] << 24)).astype(np.float32) / 2147483648.0
+    elif audio_format == "S24_LE":
+        # 24 valid bits in the low three bytes; the top byte is not reliably sign-extended
+        samples = (np.frombuffer(data, dtype="<i4") << 8).astype(np.float32) / 2147483648.0
+    else:
+        samples = np.frombuffer(data, dtype="<i4").astype(np.float32) / 2147483648.0
+    return samples.reshape(-1, channels)
+
+class LevelMeter:
+    """RMS/peak metering of PCM teed off the capture pump.
+
+    feed() only queues the block, and analysis runs in its own task on fixed
+    LEVEL_WINDOW windows; when it falls behind, blocks are dropped rather than
+    holding up the encoder. Calls on_level(rms_db, peak_db) per window and
+    on_silence() once after SILENCE_STOP_SECONDS below SILENCE_THRESHOLD_DB."""
+
+    def __init__(self, audio_format, channels, on_level=None, on_silence=None):
+        load_numpy()
+        self.audio_format = audio_format
+        self.channels = channels
+        self.on_level = on_level
+        self.on_silence = on_silence
+        self.frame_bytes = frame_size(audio_format, channels)
+        self.window_bytes = max(1, int(Config.LEVEL_WINDOW * Config.SAMPLE_RATE)) * self.frame_bytes
+        self.blocks = asyncio.Queue(maxsize=Config.LEVEL_QUEUE_BLOCKS)
+        self.buffer = bytearray()
+        self.fed = 0  # stream offset of the next fed byte
+        self.analyzed = 0  # stream offset just past the buffered bytes
+        self.task = None
+        self.silent_seconds = 0.0
+        self.silence_reported = False
+        self.clipped = 0  # clipped windows since the last warning
+        self.last_clip_warning = 0.0
+        self.rms_db = SILENCE_DB
+        self.peak_db = SILENCE_DB
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def feed(self, data):
+        try:
+            self.blocks.put_nowait((self.fed, data))
+        except asyncio.QueueFull:
+            DROPPED_BLOCKS.inc()
+        self.fed += len(data)
+
+    async def run(self):
+        while True:
+            offset, data = await self.blocks.get()
+            if offset != self.analyzed:
+                # Blocks were dropped; restart on the next frame boundary
+                skip = (-offset) % self.frame_bytes
+                self.buffer = bytearray(data[skip:])
+            else:
+                self.buffer += data
+            self.analyzed = offset + len(data)
+            try:
+                while len(self.buffer) >= self.window_bytes:
+                    window = bytes(self.buffer[:self.window_bytes])
+                    del self.buffer[:self.window_bytes]
+                    self.analyze(window)
+            except Exception as e:
+                log(f"Error metering audio: {str(e)}")
+                self.buffer.clear()
+                self.analyzed = -1  # realign on the next block
+
+    def analyze(self, window):
+        samples = decode_pcm(window, self.audio_format, self.channels)
+        peak = float(np.abs(samples).max())
+        rms = float(np.sqrt(np.mean(np.square(samples, dtype=np.float32), axis=0)).max())
+        self.rms_db, self.peak_db = to_dbfs(rms), to_dbfs(peak)
+        LEVEL_RMS.set(round(self.rms_db, 1))
+        LEVEL_PEAK.set(round(self.peak_db, 1))
+        self.check_clipping()
+        self.check_silence()
+        if self.on_level:
+            self.on_level(self.rms_db, self.peak_db)
+
+    def check_clipping(self):
+        if self.peak_db < Config.CLIP_THRESHOLD_DB:
+            return
+        CLIPPED_WINDOWS.inc()
+        self.clipped += 1
+        now = time.monotonic()
+        if now - self.last_clip_warning >= Config.CLIP_WARNING_INTERVAL:
+            log(f"Warning: input is clipping (peak {self.peak_db:.1f} dBFS, {self.clipped} windows)",
+                event="clipping", windows=self.clipped)
+            self.last_clip_warning = now
+            self.clipped = 0
+
+    def check_silence(self):
+        if Config.SILENCE_STOP_SECONDS <= 0 or self.silence_reported:
+            return
+        if self.rms_db >= Config.SILENCE_THRESHOLD_DB:
+            self.silent_seconds = 0.0
+            return
+        self.silent_seconds += Config.LEVEL_WINDOW
+        if self.silent_seconds >= Config.SILENCE_STOP_SECONDS:
+            self.silence_reported = True
+            log(f"No audio above {Config.SILENCE_THRESHOLD_DB} dBFS for {self.silent_seconds:.1f}s",
+                event="silence_detected", seconds=round(self.silent_seconds, 1))
+            if self.on_silence:
+                self.on_silence()
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+def load_numpy():
+    """Import numpy if it is installed; returns False when it is not."""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+def level_meter_available():
+    return load_numpy()
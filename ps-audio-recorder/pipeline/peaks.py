@@ -0,0 +1,194 @@
+"""Waveform peak sidecars, written while recording.
+
+<recording name>.peaks (named after the stem, so it still matches after a
+transcode) holds min/max points at several resolutions so a waveform
+can be drawn from a few KB instead of decoding the recording:
+
+    points      finest level first, streamed while recording; each point is
+                int8 (min, max) per channel
+    levels      the coarser levels, appended when the segment is finished
+    index       one INDEX_ENTRY per level: frames per point, offset, points
+    footer      FOOTER: sample rate, frames, channels, level count, magic
+
+Read the footer from the end of the file, then the index just before it.
+A file without a footer belongs to a recording that is still running (or
+was interrupted) and holds the finest level only.
+
+    python -m pipeline.peaks recording.mp3 --points 800
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+
+from utils.logging import log
+from config import Config
+from pipeline import levels
+from pipeline.capture import SAMPLE_WIDTHS
+
+MAGIC = b"PKS1"
+INDEX_ENTRY = struct.Struct("<IQQ")  # frames per point, byte offset, point count
+FOOTER = struct.Struct("<IQBB2x4s")  # sample rate, total frames, channels, level count, magic
+PEAKS_SUFFIX = ".peaks"
+
+def peaks_path(filename):
+    return os.path.splitext(filename)[0] + PEAKS_SUFFIX
+
+# Byte holding the top 8 bits of each sample; int8 peaks need nothing else
+MSB_INDEX = {
+    "S16_LE": 1,
+    "S24_3LE": 2,
+    "S24_LE": 2,  # 24 valid bits in the low three bytes
+    "S32_LE": 3,
+}
+
+class PeakFile:
+    """Min/max peaks of one segment, computed from each block as it goes to the encoder."""
+
+    def __init__(self, path, audio_format, channels):
+        levels.load_numpy()
+        self.np = levels.np
+        self.path = path
+        self.channels = channels
+        self.width = SAMPLE_WIDTHS.get(audio_format, 4)
+        self.msb = MSB_INDEX.get(audio_format, self.width - 1)
+        self.frame_bytes = self.width * channels
+        self.resolutions = sorted(Config.PEAKS_RESOLUTIONS)
+        self.base = self.resolutions[0]
+        self.remainder = b""  # bytes of the finest point still being filled
+        self.frames = 0
+        self.points = 0  # finest-level points written
+        # Coarser levels: finest points not yet reduced, and the finished points
+        self.pending = {resolution: [] for resolution in self.resolutions[1:]}
+        self.coarse = {resolution: [] for resolution in self.resolutions[1:]}
+        # Recordings never share a stem, so an existing sidecar belongs to another take
+        self.file = open(path, "xb")
+        self.failed = False
+
+    def write(self, data):
+        if self.failed:
+            return
+        try:
+            self.add(data)
+        except Exception as e:
+            # The recording matters more than its waveform
+            log(f"Error writing waveform peaks to {self.path}, giving up on them: {str(e)}")
+            self.failed = True
+
+    def add(self, data):
+        np = self.np
+        if self.remainder:
+            data = self.remainder + bytes(data)
+        point_bytes = self.base * self.frame_bytes
+        usable = len(data) - len(data) % point_bytes
+        self.remainder = bytes(data[usable:])
+        if usable:
+            self.frames += usable // self.frame_bytes
+            self.emit(np.frombuffer(data, dtype=np.int8, count=usable)[self.msb::self.width]
+                      .reshape(-1, self.base, self.channels))
+
+    def emit(self, samples):
+        """samples: int8 array of shape (points, frames per point, channels)."""
+        np = self.np
+        # Reducing along the last, contiguous axis is many times faster than across frames
+        samples = samples.transpose(0, 2, 1).copy()
+        points = np.stack((samples.min(axis=2), samples.max(axis=2)), axis=-1)  # (points, channels, 2)
+        self.file.write(points.tobytes())
+        self.points += len(points)
+        for resolution, pending in self.pending.items():
+            pending.append(points)
+            self.reduce(resolution, resolution // self.base)
+
+    def reduce(self, resolution, ratio, final=False):
+        np = self.np
+        pending = self.pending[resolution]
+        points = np.concatenate(pending) if len(pending) > 1 else pending[0]
+        full = len(points) - len(points) % ratio
+        if full:
+            grouped = points[:full].reshape(-1, ratio, self.channels, 2)
+            self.coarse[resolution].append(np.stack(
+                (grouped[..., 0].min(axis=1), grouped[..., 1].max(axis=1)), axis=-1))
+        rest = points[full:]
+        if final and len(rest):
+            self.coarse[resolution].append(np.stack(
+                (rest[..., 0].min(axis=0), rest[..., 1].max(axis=0)), axis=-1)[np.newaxis])
+            rest = rest[:0]
+        self.pending[resolution] = [rest] if len(rest) else []
+
+    def close(self):
+        """Flush the last partial points and write the coarse levels, index and footer."""
+        if self.file.closed:
+            return
+        try:
+            if not self.failed:
+                self.finish()
+        except Exception as e:
+            log(f"Error finishing waveform peaks {self.path}: {str(e)}")
+        finally:
+            self.file.close()
+
+    def finish(self):
+        np = self.np
+        if self.remainder:
+            frames = len(self.remainder) // self.frame_bytes
+            if frames:
+                self.frames += frames
+                partial = np.frombuffer(self.remainder, dtype=np.int8,
+                                        count=frames * self.frame_bytes)[self.msb::self.width]
+                self.emit(partial.reshape(1, frames, self.channels))
+        index = [(self.base, 0, self.points)]
+        offset = self.points * self.channels * 2
+        for resolution in self.pending:
+            if self.pending[resolution]:
+                self.reduce(resolution, resolution // self.base, final=True)
+            data = b"".join(points.tobytes() for points in self.coarse[resolution])
+            self.file.write(data)
+            index.append((resolution, offset, len(data) // (self.channels * 2)))
+            offset += len(data)
+        for entry in index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(FOOTER.pack(Config.SAMPLE_RATE, self.frames, self.channels, len(index), MAGIC))
+
+def read_peaks(path, points=None):
+    """(sample rate, frames, channels, frames per point, data) from a finished
+    sidecar, using the coarsest level with at least `points` points (the
+    finest when points is None). data is int8 min/max pairs per channel."""
+    with open(path, "rb") as f:
+        f.seek(-FOOTER.size, os.SEEK_END)
+        sample_rate, frames, channels, level_count, magic = FOOTER.unpack(f.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a finished peaks file")
+        f.seek(-FOOTER.size - level_count * INDEX_ENTRY.size, os.SEEK_END)
+        index = [INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size)) for _ in range(level_count)]
+        index.sort()
+        chosen = index[0]
+        if points:
+            for entry in index:
+                if entry[2] >= points:
+                    chosen = entry
+        resolution, offset, count = chosen
+        f.seek(offset)
+        return sample_rate, frames, channels, resolution, f.read(count * channels * 2)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print the waveform peaks of a recording as JSON.")
+    parser.add_argument("path", help="recording or its .peaks sidecar")
+    parser.add_argument("--points", type=int, help="smallest number of points wanted")
+    args = parser.parse_args(argv)
+    path = args.path if args.path.endswith(PEAKS_SUFFIX) else peaks_path(args.path)
+    sample_rate, frames, channels, resolution, data = read_peaks(path, args.points)
+    values = struct.unpack(f"{len(data)}b", data)
+    print(json.dumps({
+        "sample_rate": sample_rate,
+        "frames": frames,
+        "channels": channels,
+        "frames_per_point": resolution,
+        # [[min, max] per channel] per point
+        "peaks": [[list(values[i + c * 2:i + c * 2 + 2]) for c in range(channels)]
+                  for i in range(0, len(values), channels * 2)],
+    }))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
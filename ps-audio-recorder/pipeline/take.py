@@ -0,0 +1,345 @@
+import asyncio
+import collections
+import os
+import time
+
+from utils.logging import log
+from utils.metrics import metrics
+from utils.sched import apply_policy, encoder_command
+from config import Config
+from pipeline.encoders import cheaper_encoder
+from pipeline.peaks import PeakFile, peaks_path
+from storage.partial import part_path, sync_file, finalize_part
+
+ENCODER_BYTES = metrics.counter("recorder_encoder_input_bytes_total", "PCM bytes written to the encoder")
+ENCODER_DRAIN = metrics.histogram("recorder_encoder_drain_seconds", "Time the pump waited for the encoder to accept a chunk")
+ENCODER_STALL = metrics.gauge("recorder_encoder_stall_ratio", "Share of the last lag window spent waiting on the encoder")
+ENCODER_REALTIME = metrics.gauge("recorder_encoder_realtime_factor", "Encoder throughput over the last lag window, in multiples of realtime")
+ENCODER_STDERR = metrics.counter("recorder_encoder_stderr_lines_total", "Lines the encoder wrote to stderr")
+ENCODER_DEGRADED = metrics.counter("recorder_encoder_degraded_total", "Switches to a cheaper encoder")
+ENCODER_EXITS = metrics.counter("recorder_encoder_exits_total", "Encoders that exited while their segment was still open")
+SEGMENTS = metrics.counter("recorder_segments_total", "Segment files started")
+
+class Take:
+    """One recording: PCM from a CaptureStream encoded into one or more segment files.
+
+    Segments roll over on frame boundaries while capture keeps running, so
+    every captured sample lands in exactly one segment."""
+
+    def __init__(self, capture, new_filename, encoder, on_limit=None, on_segment_opened=None,
+                 on_segment_finished=None, on_failed=None, peaks=False):
+        self.capture = capture
+        self.new_filename = new_filename  # (extension) -> path for the next segment
+        self.encoder = encoder  # Encoder backend used for new segments
+        self.on_limit = on_limit  # called once when MAX_RECORDING_TIME is reached
+        self.on_segment_opened = on_segment_opened  # (output file, encoder) before the encoder writes to it
+        self.on_segment_finished = on_segment_finished  # (filename, encoder, seconds of audio) once a segment file is complete
+        self.on_failed = on_failed  # called once when no encoder is left to take the audio
+        self.frame_bytes = capture.frame_bytes
+        self.segment_limit = 0
+        if Config.SEGMENT_SECONDS > 0:
+            self.segment_limit = int(Config.SEGMENT_SECONDS * Config.SAMPLE_RATE) * self.frame_bytes
+        self.max_bytes = int(Config.MAX_RECORDING_TIME * Config.SAMPLE_RATE) * self.frame_bytes
+        self.filename = None  # final name of the current segment
+        self.part_filename = None  # where the current segment is written until it is finalized
+        self.output = None  # open .part file; kept for periodic syncs
+        self.peaks_enabled = peaks  # write a waveform sidecar per segment (needs numpy)
+        self.peaks = None  # PeakFile for the current segment
+        self.process = None  # encoder process for the current segment
+        self.segment_encoder = None  # backend the current segment was started with
+        self.spawned_at = None  # wall-clock time the current segment's encoder was spawned
+        self.segments = []
+        self.segment_bytes = 0  # PCM bytes in the current segment
+        self.total_bytes = 0  # PCM bytes in the whole take
+        self.rollover_requested = False
+        self.limit_reached = False
+        self.closed = False
+        self.failed = False  # every encoder gave up; audio is no longer written
+        self.lock = asyncio.Lock()
+        self.finishing = set()
+        self.stderr_tasks = {}  # encoder process -> task draining its stderr
+        self.sync_task = None
+        self.encoder_errors = collections.deque(maxlen=10)  # recent encoder stderr lines
+        # Realtime tracking: time spent blocked on the encoder per window
+        self.window_start = time.monotonic()
+        self.window_stall = 0.0
+        self.window_bytes = 0
+
+    async def open(self):
+        await self.start_segment()
+        if Config.FSYNC_INTERVAL > 0:
+            self.sync_task = asyncio.create_task(self.sync_periodically())
+
+    async def start_segment(self):
+        encoder = self.encoder
+        filename = self.new_filename(encoder.extension)
+        command = encoder_command(encoder.command())
+        log(f"Setting up recording: {filename}")
+        part = part_path(filename)
+        log(f"Starting recording pipeline: {' '.join(self.capture.command())} | {' '.join(command)} > {part}")
+        output = open(part, "wb")
+        try:
+            if self.on_segment_opened:
+                self.on_segment_opened(output, encoder)
+            self.process = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=output,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except Exception:
+            output.close()
+            raise
+        self.spawned_at = time.time()
+        apply_policy(self.process.pid, "encoder", self.capture.encoder_cpus)
+        if self.peaks_enabled:
+            try:
+                self.peaks = PeakFile(peaks_path(filename), self.capture.audio_format, self.capture.channels)
+                # Same group and permissions as the recording
+                stat = os.fstat(output.fileno())
+                os.chmod(self.peaks.path, stat.st_mode & 0o777)
+                os.chown(self.peaks.path, -1, stat.st_gid)
+            except Exception as e:
+                log(f"Could not create waveform peaks for {filename}: {str(e)}")
+                self.peaks = None
+        self.output = output
+        self.part_filename = part
+        self.process.stdin.write(self.capture.wav_header)
+        self.stderr_tasks[self.process] = asyncio.create_task(self.watch_stderr(self.process, encoder))
+        SEGMENTS.inc(encoder=encoder.name)
+        self.filename = filename
+        self.segment_encoder = encoder
+        self.segments.append(filename)
+        self.segment_bytes = 0
+
+    async def watch_stderr(self, process, encoder):
+        """Drain the encoder's stderr so it never blocks, keeping the last lines for errors."""
+        try:
+            async for line in process.stderr:
+                text = line.decode(errors="ignore").strip()
+                if text:
+                    ENCODER_STDERR.inc(encoder=encoder.name)
+                    self.encoder_errors.append(text)
+                    log(f"{encoder.name}: {text}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log(f"Error reading encoder stderr: {str(e)}")
+
+    async def encoder_error(self):
+        """Recent stderr output of the encoders, once an exited encoder's output has been read."""
+        task = self.stderr_tasks.get(self.process)
+        if task and self.process.returncode is not None:
+            await asyncio.wait({task}, timeout=1)
+        return " ".join(self.encoder_errors)
+
+    async def sync_periodically(self):
+        """Bound what a power cut can lose to FSYNC_INTERVAL seconds of audio,
+        without syncing so often that SD card throughput suffers."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(Config.FSYNC_INTERVAL)
+            output = self.output
+            if output is None or output.closed:
+                continue
+            try:
+                await loop.run_in_executor(None, sync_file, output)
+            except Exception as e:
+                log(f"Error syncing {self.part_filename}: {str(e)}")
+
+    def request_rollover(self):
+        """Start a new segment at the next frame boundary."""
+        if self.segment_bytes > 0:
+            self.rollover_requested = True
+
+    def room(self):
+        """Bytes that still fit in the current segment, or None for no limit."""
+        if self.rollover_requested:
+            return (-self.segment_bytes) % self.frame_bytes
+        if self.segment_limit:
+            return max(0, self.segment_limit - self.segment_bytes)
+        return None
+
+    async def write(self, data):
+        async with self.lock:
+            if self.closed or self.failed:
+                return
+            view = memoryview(data)
+            while view:
+                if self.encoder_gone():
+                    if not await self.replace_encoder("encoder exited"):
+                        return
+                    continue
+                room = self.room()
+                if room == 0:
+                    await self.rollover()
+                    continue
+                part = view if room is None else view[:room]
+                self.process.stdin.write(part)
+                if self.peaks:
+                    self.peaks.write(part)
+                self.segment_bytes += len(part)
+                self.total_bytes += len(part)
+                view = view[len(part):]
+            stall_start = time.monotonic()
+            try:
+                await self.process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError) as e:
+                # What the dead encoder hadn't read yet is lost; the next block goes to a new segment
+                await self.replace_encoder(str(e) or "encoder input closed")
+                return
+            stall = time.monotonic() - stall_start
+            ENCODER_DRAIN.observe(stall)
+            ENCODER_BYTES.inc(len(data), encoder=self.segment_encoder.name)
+            self.window_stall += stall
+            self.window_bytes += len(data)
+            self.check_limits()
+            self.check_realtime()
+
+    def check_limits(self):
+        if Config.SEGMENT_MAX_BYTES > 0 and not self.rollover_requested:
+            try:
+                if os.path.getsize(self.part_filename) >= Config.SEGMENT_MAX_BYTES:
+                    self.request_rollover()
+            except OSError:
+                pass
+        if (Config.STOP_AT_MAX_RECORDING_TIME and not self.limit_reached
+                and self.total_bytes >= self.max_bytes):
+            self.limit_reached = True
+            log(f"Reached MAX_RECORDING_TIME ({Config.MAX_RECORDING_TIME}s)", event="max_recording_time")
+            if self.on_limit:
+                self.on_limit()
+
+    def check_realtime(self):
+        """Switch to a cheaper encoder when the current one cannot keep up with capture."""
+        elapsed = time.monotonic() - self.window_start
+        if elapsed < Config.ENCODER_LAG_WINDOW:
+            return
+        stall_ratio = self.window_stall / elapsed
+        realtime = self.window_bytes / (elapsed * self.capture.bytes_per_second)
+        self.reset_window()
+        ENCODER_STALL.set(round(stall_ratio, 4))
+        ENCODER_REALTIME.set(round(realtime, 3))
+        if stall_ratio > Config.ENCODER_LAG_THRESHOLD:
+            self.degrade(f"blocked {stall_ratio:.0%} of the time, {realtime:.2f}x realtime")
+
+    def reset_window(self):
+        self.window_start = time.monotonic()
+        self.window_stall = 0.0
+        self.window_bytes = 0
+
+    def on_overrun(self, milliseconds):
+        # Blame the encoder if it held the pump up at least as long as the overrun
+        if self.window_stall >= milliseconds / 1000:
+            self.degrade(f"capture overrun of at least {milliseconds}ms")
+
+    def degrade(self, reason):
+        if not Config.ENCODER_ADAPTIVE or self.encoder is not self.segment_encoder:
+            return
+        fallback = cheaper_encoder(self.encoder)
+        if fallback is None:
+            log(f"Encoder {self.encoder.name} is falling behind ({reason}) and no cheaper encoder is configured")
+            return
+        log(f"Encoder {self.encoder.name} is falling behind ({reason}), switching to {fallback.name}",
+            event="encoder_degraded", encoder=fallback.name)
+        ENCODER_DEGRADED.inc()
+        self.encoder = fallback
+        self.request_rollover()
+        self.reset_window()
+
+    def encoder_gone(self):
+        return self.process.returncode is not None or self.process.stdin.is_closing()
+
+    async def replace_encoder(self, reason):
+        """The encoder exited while its segment was open: carry on in a new
+        segment through the gapless rollover, with the next cheaper encoder
+        (it may have refused the input format) or, failing that, the same one
+        again if it had been running for a while. Returns False when the take
+        can't continue."""
+        failed = self.segment_encoder
+        ENCODER_EXITS.inc(encoder=failed.name)
+        fallback = cheaper_encoder(failed)
+        if fallback is None and self.segment_bytes >= self.capture.bytes_per_second:
+            fallback = failed
+        if fallback is None:
+            log(f"Encoder {failed.name} exited ({reason}) and there is no encoder left to switch to",
+                event="recording_failed", file=self.filename)
+            self.failed = True
+            if self.on_failed:
+                self.on_failed()
+            return False
+        log(f"Encoder {failed.name} exited mid-take ({reason}), continuing with {fallback.name} in a new segment",
+            event="encoder_exited", encoder=fallback.name, file=self.filename)
+        self.encoder = fallback
+        self.reset_window()
+        try:
+            await self.rollover()
+        except Exception as e:
+            log(f"Could not start {fallback.name} after {failed.name} exited: {str(e)}",
+                event="recording_failed", file=self.filename)
+            self.failed = True
+            if self.on_failed:
+                self.on_failed()
+            return False
+        return True
+
+    async def rollover(self):
+        old = (self.process, self.filename, self.segment_encoder, self.output, self.segment_bytes)
+        if self.peaks:
+            self.peaks.close()
+        await self.start_segment()
+        self.rollover_requested = False
+        old[0].stdin.close()
+        self.finishing.add(asyncio.create_task(self.finish_segment(*old)))
+        log(f"Rolled over to new segment: {self.filename}", event="segment_rollover", file=self.filename)
+
+    async def finish_segment(self, process, filename, encoder, output, pcm_bytes):
+        try:
+            await asyncio.wait_for(process.wait(), timeout=10)
+        except Exception as e:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            log(f"Warning: Error stopping encoder for {filename}: {str(e)}")
+        stderr_task = self.stderr_tasks.pop(process, None)
+        if stderr_task:
+            try:
+                await asyncio.wait_for(stderr_task, timeout=1)
+            except asyncio.TimeoutError:
+                pass
+        part = part_path(filename)
+        encoder.finalize(part, len(self.capture.wav_header))
+        try:
+            # fdatasync can take a while on an SD card; keep the pump running meanwhile
+            await asyncio.get_running_loop().run_in_executor(None, finalize_part, output, part, filename)
+        except Exception as e:
+            log(f"Error finalizing {filename}, leaving it as {part}: {str(e)}")
+            return
+        if self.on_segment_finished:
+            try:
+                self.on_segment_finished(filename, encoder, pcm_bytes / self.capture.bytes_per_second)
+            except Exception as e:
+                log(f"Error handling finished segment {filename}: {str(e)}")
+
+    async def close(self):
+        """Let the encoders flush the remaining audio and exit."""
+        if self.sync_task:
+            self.sync_task.cancel()
+            self.sync_task = None
+        async with self.lock:
+            self.closed = True
+            if self.peaks:
+                self.peaks.close()
+                self.peaks = None
+            if self.process:
+                try:
+                    # Closing stdin lets the encoder flush and exit
+                    self.process.stdin.close()
+                except Exception:
+                    pass
+                await self.finish_segment(self.process, self.filename, self.segment_encoder, self.output,
+                                          self.segment_bytes)
+        if self.finishing:
+            await asyncio.gather(*self.finishing)
+            self.finishing = set()
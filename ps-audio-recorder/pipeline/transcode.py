@@ -0,0 +1,217 @@
+import asyncio
+import json
+import os
+import shutil
+import signal
+import time
+
+from utils.logging import log
+from config import Config
+from pipeline.encoders import get_encoder
+
+def decode_command(source):
+    """Command writing source as WAV to stdout, or None when the file is already WAV."""
+    if source.endswith(".flac"):
+        return ["flac", "-d", "-c", "--silent", source]
+    return None
+
+def low_priority(command):
+    prefix = ["nice", "-n", str(Config.TRANSCODE_NICE)]
+    if shutil.which("ionice"):
+        prefix += ["ionice", "-c", "3"]
+    return prefix + command
+
+def worker_count():
+    if Config.TRANSCODE_WORKERS > 0:
+        return Config.TRANSCODE_WORKERS
+    # Leave two cores for capture, the encoder and everything else
+    return max(1, (os.cpu_count() or 1) - 2)
+
+class TranscodeQueue:
+    """Background encoding of finished lossless recordings.
+
+    Jobs are JSON files in TRANSCODE_QUEUE_DIR, so transcodes interrupted by
+    a crash or reboot are picked up again on the next start. Workers run at
+    low CPU/IO priority and are paused (SIGSTOP) while a recording is active."""
+
+    def __init__(self, queue_dir=None):
+        self.queue_dir = queue_dir or Config.TRANSCODE_QUEUE_DIR
+        self.jobs = asyncio.Queue()
+        self.workers = []
+        self.processes = set()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.on_done = None  # called with (source, target, encoder name, source removed)
+
+    def start(self):
+        try:
+            os.makedirs(self.queue_dir, exist_ok=True)
+            pending = [os.path.join(self.queue_dir, name) for name in os.listdir(self.queue_dir)
+                       if name.endswith(".json")]
+        except Exception as e:
+            log(f"Error opening transcode queue: {str(e)}")
+            pending = []
+        for job_path in sorted(pending, key=os.path.getmtime):
+            self.jobs.put_nowait(job_path)
+        if pending:
+            log(f"Resuming {len(pending)} pending transcode jobs")
+        for _ in range(worker_count()):
+            self.workers.append(asyncio.create_task(self.worker()))
+
+    def submit(self, source, encoder_name):
+        job = {"source": source, "encoder": encoder_name, "created": time.time(), "attempts": 0}
+        job_path = os.path.join(self.queue_dir, os.path.basename(source) + ".json")
+        try:
+            self.write_job(job_path, job)
+        except Exception as e:
+            log(f"Error queueing transcode of {source}: {str(e)}")
+            return
+        log(f"Queued transcode of {source} to {encoder_name}", event="transcode_queued", file=source)
+        self.jobs.put_nowait(job_path)
+
+    def write_job(self, job_path, job):
+        tmp_path = job_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, job_path)
+
+    def pause(self):
+        self.idle.clear()
+        for process in self.processes:
+            try:
+                process.send_signal(signal.SIGSTOP)
+            except ProcessLookupError:
+                pass
+
+    def resume(self):
+        for process in self.processes:
+            try:
+                process.send_signal(signal.SIGCONT)
+            except ProcessLookupError:
+                pass
+        self.idle.set()
+
+    async def worker(self):
+        while True:
+            job_path = await self.jobs.get()
+            await self.idle.wait()
+            try:
+                await self.run_job(job_path)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log(f"Error running transcode job {job_path}: {str(e)}")
+
+    async def run_job(self, job_path):
+        try:
+            with open(job_path, "r") as f:
+                job = json.load(f)
+        except FileNotFoundError:
+            return
+        source = job["source"]
+        encoder = get_encoder(job["encoder"])
+        if not os.path.exists(source):
+            log(f"Transcode source {source} is gone, dropping job")
+            os.remove(job_path)
+            return
+
+        target = os.path.splitext(source)[0] + "." + encoder.extension
+        partial = target + ".transcoding"
+        if self.target_taken(source, target, job_path):
+            return
+        started = time.monotonic()
+        log(f"Transcoding {source} -> {target}")
+        if await self.encode(source, partial, encoder):
+            if self.target_taken(source, target, job_path):
+                os.remove(partial)
+                return
+            stat = os.stat(source)
+            os.chmod(partial, stat.st_mode & 0o777)
+            try:
+                os.chown(partial, -1, stat.st_gid)
+            except PermissionError:
+                pass
+            os.replace(partial, target)
+            source_removed = not Config.TRANSCODE_KEEP_SOURCE and source != target
+            if source_removed:
+                os.remove(source)
+            os.remove(job_path)
+            log(f"Transcoded {target} in {time.monotonic() - started:.1f}s", event="transcode_done", file=target)
+            if self.on_done:
+                self.on_done(source, target, encoder.name, source_removed)
+            return
+
+        if os.path.exists(partial):
+            os.remove(partial)
+        job["attempts"] += 1
+        if job["attempts"] >= Config.TRANSCODE_MAX_ATTEMPTS:
+            log(f"Giving up on transcoding {source} after {job['attempts']} attempts", event="transcode_failed", file=source)
+            os.replace(job_path, job_path[:-len(".json")] + ".failed")
+        else:
+            self.write_job(job_path, job)
+            self.jobs.put_nowait(job_path)
+
+    def target_taken(self, source, target, job_path):
+        """Drop the job, keeping the source, if target is already a recording; never replace it.
+        Re-encoding into the same format replaces the source itself, which is fine."""
+        if target == source or not os.path.exists(target):
+            return False
+        log(f"Not transcoding {source}: {target} already exists, keeping both",
+            event="transcode_skipped", file=source, target=target)
+        os.remove(job_path)
+        return True
+
+    async def encode(self, source, target, encoder):
+        """Run [decoder |] encoder at low priority; returns True on success."""
+        decoder = process = None
+        decoder_command = decode_command(source)
+        try:
+            with open(target, "wb") as output:
+                if decoder_command:
+                    read_fd, write_fd = os.pipe()
+                    try:
+                        decoder = await asyncio.create_subprocess_exec(
+                            *low_priority(decoder_command), stdout=write_fd,
+                            stderr=asyncio.subprocess.DEVNULL)
+                    finally:
+                        os.close(write_fd)
+                    stdin = read_fd
+                else:
+                    stdin = os.open(source, os.O_RDONLY)
+                try:
+                    process = await asyncio.create_subprocess_exec(
+                        *low_priority(encoder.command()), stdin=stdin, stdout=output,
+                        stderr=asyncio.subprocess.PIPE)
+                finally:
+                    os.close(stdin)
+            self.processes.update(p for p in (decoder, process) if p)
+            if not self.idle.is_set():
+                self.pause()
+            _, stderr = await process.communicate()
+            if decoder:
+                await decoder.wait()
+            ok = process.returncode == 0 and (decoder is None or decoder.returncode == 0)
+            if not ok:
+                log(f"Transcode of {source} failed: {stderr.decode(errors='ignore').strip()}")
+            return ok
+        except asyncio.CancelledError:
+            for p in (decoder, process):
+                if p and p.returncode is None:
+                    p.kill()
+            raise
+        finally:
+            self.processes.difference_update((decoder, process))
+
+    async def close(self):
+        """Stop workers; unfinished jobs stay on disk and resume on the next start."""
+        self.resume()
+        for task in self.workers:
+            task.cancel()
+        for task in self.workers:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.workers = []
@@ -1,179 +1,643 @@
 import os
-import time
 import grp
-import subprocess
+import json
+import time
 from datetime import datetime
+from functools import partial
 import asyncio
 
 from utils.logging import log
+from utils.metrics import metrics
 from config import Config
-from devices.audio import get_usb_audio_device, get_optimal_settings
-from kasa import SmartBulb
+from devices.audio import AudioDeviceCache, device_label, get_optimal_settings
+from pipeline.capture import CaptureStream
+from pipeline.encoders import get_encoder
+from pipeline.levels import LevelMeter, level_meter_available
+from pipeline.peaks import PEAKS_SUFFIX, peaks_path
+from pipeline.take import Take
+from pipeline.transcode import TranscodeQueue
+from storage.catalog import Catalog
+from storage.partial import PART_SUFFIX, part_path, recover_partial_recordings
+from storage.replicate import Replicator
+from storage.space import RECORDING_EXTENSIONS, StorageManager
+from utils.profile import startup
+from utils.sched import lock_memory, pipeline_cpus
+from utils.trace import tracer
+
+RECORDINGS = metrics.counter("recorder_recordings_total", "Recording start attempts by result")
+COMMANDS = metrics.counter("recorder_commands_total", "Start/stop/toggle commands by source and outcome")
+START_SECONDS = metrics.histogram("recorder_start_seconds", "Time from start request until audio reached the encoder")
+
+IDLE, STARTING, RECORDING, STOPPING = "idle", "starting", "recording", "stopping"
+COMMAND_NAMES = ("start", "stop", "toggle")
+_missing_groups = set()
+
+def recording_gid():
+    """gid of RECORDING_GROUP, or None (logged once) when it isn't configured or doesn't exist."""
+    if not Config.RECORDING_GROUP:
+        return None
+    try:
+        return grp.getgrnam(Config.RECORDING_GROUP).gr_gid
+    except KeyError:
+        if Config.RECORDING_GROUP not in _missing_groups:
+            _missing_groups.add(Config.RECORDING_GROUP)
+            log(f"Group {Config.RECORDING_GROUP} does not exist, recordings keep the default group")
+        return None
+
+def name_taken(stem):
+    """Whether any recording, .part or .peaks sidecar already uses stem, whatever its format;
+    a transcode or the peaks file would otherwise overwrite the other take's."""
+    paths = [stem + extension for extension in RECORDING_EXTENSIONS]
+    paths += [part_path(path) for path in paths]
+    return any(os.path.exists(path) for path in paths + [stem + PEAKS_SUFFIX])
 
 class Recorder:
-    def __init__(self, kasa_device: SmartBulb = None):
-        self.recording = False
-        self.process = None
-        self.kasa_device = kasa_device
-        self.original_bulb_state = None
-        self.encoder_process = None  # lame process
-    
-    async def start(self):
-        if self.recording:
-            return False
-            
+    """Runs takes from start/stop/toggle commands.
+
+    Commands from every source (buttons, keyboard, control API, reconnects,
+    auto-stops) go through submit(), which returns at once. run() handles
+    them one at a time, so transitions never interleave; commands that queue
+    up during a transition are folded into one, and button presses within
+    PRESS_DEBOUNCE_SECONDS of the last one are dropped."""
+
+    def __init__(self, kasa_device=None):
+        self.state = IDLE
+        self.commands = asyncio.Queue()  # (command, future, trace)
+        self.last_press = 0.0  # event time of the last accepted button press
+        self.kasa_device = None
+        self.light = None
+        self.captures = []  # one CaptureStream per audio device; kept running between takes when pre-roll is enabled
+        self.takes = []  # one Take per device for the current recording, in the same order
+        self.file_time = None  # shared timestamp for the first files of a take
+        self.take_info = None  # alignment data for a multi-device take, see write_take_info
+        self.take_info_file = None
+        self.transcoder = TranscodeQueue() if Config.TRANSCODE_TO else None
+        self.transcode_pending = []  # finished lossless segments, queued once the take stops
+        self.replicator = Replicator(busy=lambda: self.recording) if Config.REPLICATE_TO else None
+        self.replicate_pending = []  # finished files of the current take, mirrored once it stops
+        self.audio_devices = AudioDeviceCache()
+        self.storage = StorageManager()
+        self.catalog = Catalog() if Config.CATALOG_FILE else None
+        self.take_started = None  # time.time() when the current take started
+        self.meter = None  # LevelMeter for the current recording
+        self.level_listener = None  # called with (rms_db, peak_db) per metering window
+        self.light_trace = None  # trace waiting for the bulb to confirm the last start or stop
+        self.output_watch = None
+        if kasa_device is not None:
+            self.set_light(kasa_device)
+
+    @property
+    def recording(self):
+        return self.state in (STARTING, RECORDING)
+
+    @property
+    def capture(self):
+        """Capture of the first device, which also feeds the level meter."""
+        return self.captures[0] if self.captures else None
+
+    @property
+    def take(self):
+        return self.takes[0] if self.takes else None
+
+    def set_light(self, bulb):
+        """Attach (or replace) the recording light once background discovery finds it."""
+        if self.light is None:
+            # kasa is only imported once there is a bulb to drive
+            from devices.light import LightController
+            self.kasa_device = bulb
+            self.light = LightController(bulb)
+            self.light.on_applied = self.on_light_applied
+            if self.recording:
+                self.light.set_recording(True)
+        else:
+            self.kasa_device = bulb
+            self.light.replace_bulb(bulb)
+
+    async def open(self):
+        """Probe the audio devices once and start always-on capture if pre-roll is enabled."""
+        with startup.phase("memory_lock"):
+            lock_memory()
+        with startup.phase("partial_recovery"):
+            recovered = recover_partial_recordings()
+        if self.catalog:
+            with startup.phase("catalog_open"):
+                self.open_catalog()
+        with startup.phase("audio_probe"):
+            await self.recording_devices()
+        if self.transcoder:
+            with startup.phase("transcode_queue"):
+                self.transcoder.start()
+                target_extension = get_encoder(Config.TRANSCODE_TO).extension
+                for filename in recovered:
+                    if not filename.endswith("." + target_extension):
+                        self.transcoder.submit(filename, Config.TRANSCODE_TO)
+                self.transcoder.on_done = self.on_transcoded
+        if self.replicator:
+            with startup.phase("replicate_queue"):
+                self.replicator.start()
+        if Config.PREROLL_SECONDS <= 0:
+            return
         try:
-            self.recording = True
-            
-            # Set umask for correct file permissions
-            old_umask = os.umask(0o002)
-            try:
-                filename = os.path.join(
-                    Config.RECORDING_DIR,
-                    f"{Config.RECORDING_PREFIX}-{datetime.now().strftime(Config.TIMESTAMP_FORMAT)}.{Config.RECORDING_EXTENSION}"
-                )
-                
-                # Pre-create the file with correct permissions
-                with open(filename, 'w') as f:
-                    pass
-                os.chown(filename, os.getuid(), grp.getgrnam('audiofiles').gr_gid)
-                os.chmod(filename, 0o664)
-                
-                log(f"Setting up recording: {filename}")
-
-                # Build arecord base command (output to stdout for piping)
-                arecord_command = ["arecord", "-r", str(Config.SAMPLE_RATE), "-t", "wav"]
-                
-                audio_device = get_usb_audio_device()
-                if audio_device:
-                    log(f"Using USB audio device: {audio_device}")
-                    arecord_command.extend(["-D", audio_device])
-                    audio_format, channels = get_optimal_settings(audio_device)
-                else:
-                    log("Using default audio device")
-                    audio_format, channels = Config.AUDIO_FORMAT, Config.CHANNELS
-                
-                if audio_format:
-                    arecord_command.extend(["-f", audio_format])
-                arecord_command.extend(["-c", str(channels)])
-                # (No output filename so data goes to stdout)
-
-                lame_command = [
-                    "lame",
-                    "--ignorelength",
-                    "--preset", "extreme",
-                    "--silent",
-                    "-",  # stdin
-                    filename
-                ]
-
-                log(f"Starting recording pipeline: {' '.join(arecord_command)} | {' '.join(lame_command)}")
-                self.process = subprocess.Popen(arecord_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                self.encoder_process = subprocess.Popen(lame_command, stdin=self.process.stdout, stderr=subprocess.PIPE)
-                # Detach stdout so arecord doesn't get SIGPIPE when we terminate lame
-                self.process.stdout.close()
-
-                time.sleep(1)
-
-                if self.process.poll() is not None or self.encoder_process.poll() is not None:
-                    # Gather stderr for diagnostics
-                    arecord_err = ""
-                    lame_err = ""
-                    if self.process:
-                        try:
-                            _, aerr = self.process.communicate(timeout=0.2)
-                            arecord_err = aerr.decode(errors="ignore").strip()
-                        except Exception:
-                            pass
-                    if self.encoder_process:
-                        try:
-                            _, lerr = self.encoder_process.communicate(timeout=0.2)
-                            lame_err = lerr.decode(errors="ignore").strip()
-                        except Exception:
-                            pass
-                    log(f"Recording failed to start. arecord err: {arecord_err} lame err: {lame_err}")
-                    self.recording = False
-                    # Cleanup
-                    if self.process and self.process.poll() is None:
-                        try: self.process.terminate()
-                        except: pass
-                    if self.encoder_process and self.encoder_process.poll() is None:
-                        try: self.encoder_process.terminate()
-                        except: pass
-                    self.process = None
-                    self.encoder_process = None
-                    return False
-                else:
-                    log("Recording (MP3) started successfully")
-                    # Only control light after recording starts successfully
-                    if self.kasa_device is not None:
-                        try:
-                            from devices.light import set_recording_state
-                            self.original_bulb_state = await set_recording_state(self.kasa_device, start=True)
-                        except Exception as e:
-                            log(f"Warning: Could not control Kasa bulb: {str(e)}")
-                    return True
-                    
-            finally:
-                os.umask(old_umask)
-                
+            with startup.phase("preroll_capture"):
+                self.captures = await self.start_captures(Config.PREROLL_SECONDS)
+            log(f"Pre-roll capture running ({Config.PREROLL_SECONDS}s, {self.capture.preroll.capacity} bytes)"
+                + (f" on {len(self.captures)} devices" if len(self.captures) > 1 else ""))
         except Exception as e:
-            log(f"Error in start_recording: {str(e)}")
-            self.recording = False
-            if self.process:
-                try:
-                    self.process.terminate()
-                    self.process.wait()
-                except Exception as e2:
-                    log(f"Warning: Error terminating arecord: {str(e2)}")
-            if self.encoder_process:
-                try:
-                    self.encoder_process.terminate()
-                    self.encoder_process.wait()
-                except Exception as e3:
-                    log(f"Warning: Error terminating lame: {str(e3)}")
-            self.process = None
-            self.encoder_process = None
-            return False
-    
-    async def stop(self):
-        if not self.recording:
+            log(f"Could not start pre-roll capture, recording without it: {str(e)}")
+            self.captures = []
+
+    def open_catalog(self):
+        try:
+            self.catalog.open()
+        except Exception as e:
+            log(f"Could not open recordings catalog {self.catalog.path}: {str(e)}")
+            self.catalog = None
             return
-        
-        # Turn off light before stopping recording
-        if self.kasa_device is not None and self.original_bulb_state is not None:
+        self.storage.on_deleted = lambda path: self.catalog.submit(self.catalog.removed, path)
+        # Files may have been copied in, deleted or salvaged while the recorder was down
+        self.catalog.submit(self.reconcile_catalog)
+
+    def reconcile_catalog(self):
+        added, removed, updated = self.catalog.reconcile()
+        if added or removed or updated:
+            log(f"Recordings catalog reconciled: {added} added, {removed} removed, {updated} updated",
+                event="catalog_reconciled", added=added, removed=removed, updated=updated)
+
+    async def close(self):
+        await self.stop()
+        if self.light:
+            await self.light.close()
+        if self.transcoder:
+            await self.transcoder.close()
+        if self.replicator:
+            await self.replicator.close()
+        if self.catalog:
+            self.catalog.close()
+        for capture in self.captures:
+            await capture.stop()
+        self.captures = []
+
+    async def recording_devices(self):
+        devices = await self.audio_devices.get_all(
+            busy={capture.device for capture in self.captures if capture.is_running()})
+        return devices if Config.RECORD_ALL_DEVICES else devices[:1]
+
+    async def start_capture(self, capabilities, preroll_seconds=0, cpus=(None, None)):
+        if capabilities.device:
+            log(f"Using USB audio device: {capabilities.device}")
+            audio_format, channels = get_optimal_settings(capabilities)
+        else:
+            log("Using default audio device")
+            audio_format, channels = Config.AUDIO_FORMAT, Config.CHANNELS
+        capture = CaptureStream(capabilities.device, audio_format, channels, preroll_seconds, cpus)
+        try:
+            await capture.start()
+        except Exception:
+            # Cached capabilities may no longer match the hardware
+            self.audio_devices.invalidate()
+            raise
+        return capture
+
+    async def start_captures(self, preroll_seconds=0, running=()):
+        """Captures for every recording device, started concurrently and reusing
+        the ones in running. Devices that fail to start are left out."""
+        devices = await self.recording_devices()
+        running = {capture.device: capture for capture in running}
+        results = await asyncio.gather(*(
+            self.start_capture(capabilities, preroll_seconds, pipeline_cpus(index))
+            for index, capabilities in enumerate(devices) if capabilities.device not in running
+        ), return_exceptions=True)
+        results = iter(results)
+        captures, errors = [], []
+        for capabilities in devices:
+            capture = running.pop(capabilities.device, None) or next(results)
+            if isinstance(capture, Exception):
+                log(f"Could not start capture on {capabilities.device or 'the default device'}: {str(capture)}")
+                errors.append(capture)
+            else:
+                captures.append(capture)
+        # Devices that were unplugged since the last probe
+        for capture in running.values():
+            await capture.stop()
+        if not captures:
+            raise errors[0] if errors else RuntimeError("no audio device")
+        return captures
+
+    def create_recording_file(self, extension, label=None):
+        """label tells the files of a multi-device take apart, e.g. "card1"."""
+        # Set umask for correct file permissions
+        old_umask = os.umask(0o002)
+        try:
+            stem = os.path.join(
+                Config.RECORDING_DIR,
+                f"{Config.RECORDING_PREFIX}-{(self.file_time or datetime.now()).strftime(Config.TIMESTAMP_FORMAT)}"
+            )
+            if label:
+                stem = f"{stem}-{label}"
+            # Segments (or quick re-takes) can start within the same second
+            name, suffix = stem, 1
+            while name_taken(name):
+                name = f"{stem}-{suffix}"
+                suffix += 1
+            filename = f"{name}.{extension}"
+
+            # Pre-create the .part file with correct permissions; the rename on finalize keeps them
+            part = part_path(filename)
+            with open(part, 'w') as f:
+                pass
+            gid = recording_gid()
+            if gid is not None:
+                os.chown(part, os.getuid(), gid)
+            os.chmod(part, 0o664)
+            return filename
+        finally:
+            os.umask(old_umask)
+
+    def write_take_info(self):
+        """Record when each device's first file starts, so multi-device takes can be aligned later."""
+        if not self.take_info_file:
+            return
+        for device, take in zip(self.take_info["devices"], self.takes):
+            device["files"] = list(take.segments)
+        old_umask = os.umask(0o002)
+        try:
+            with open(self.take_info_file + ".tmp", "w") as f:
+                json.dump(self.take_info, f, indent=2)
+            os.replace(self.take_info_file + ".tmp", self.take_info_file)
+        except Exception as e:
+            log(f"Error writing {self.take_info_file}: {str(e)}")
+        finally:
+            os.umask(old_umask)
+
+    async def wait_until_ready(self, capture, take):
+        """Wait for the first PCM bytes to reach the encoder, or for either process to exit."""
+        waiters = [
+            asyncio.ensure_future(capture.delivered.wait()),
+            asyncio.ensure_future(capture.process.wait()),
+            asyncio.ensure_future(take.process.wait()),
+        ]
+        try:
+            await asyncio.wait(waiters, timeout=Config.START_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+        return (capture.delivered.is_set()
+                and capture.is_running()
+                and take.process.returncode is None)
+
+    async def drop_device(self, capture, take):
+        """Take a device that failed to start out of a multi-device take."""
+        capture.detach()
+        capture.on_overrun = None
+        await take.close()
+        self.takes.remove(take)
+        self.captures.remove(capture)
+        await capture.stop()
+
+    async def watch_first_output(self, take, trace):
+        """Mark when the encoder's first bytes reach the file."""
+        deadline = time.monotonic() + Config.TRACE_TIMEOUT
+        while not trace.finished and take.output and time.monotonic() < deadline:
             try:
-                from devices.light import set_recording_state
-                await set_recording_state(self.kasa_device, start=False, original_state=self.original_bulb_state)
-            except Exception as e:
-                log(f"Warning: Could not reset Kasa bulb: {str(e)}")
-            
-        self.recording = False
-        if self.process:
+                if os.fstat(take.output.fileno()).st_size > 0:
+                    trace.mark("first_encoded")
+                    return
+            except (OSError, ValueError):
+                return
+            await asyncio.sleep(0.002)
+
+    def on_light_applied(self, on):
+        trace = self.light_trace
+        if trace and on == (trace.action == "start"):
+            self.light_trace = None
+            trace.mark("light")
+
+    def submit(self, command, trace=None):
+        """Queue start, stop or toggle; returns a future resolved with whether
+        the recorder ended up as asked."""
+        done = asyncio.get_running_loop().create_future()
+        trace = trace or tracer.begin(command, "internal")
+        if command == "toggle" and trace.source == "button":
+            pressed = trace.marks.get("event", trace.marks["queued"])
+            if pressed - self.last_press < Config.PRESS_DEBOUNCE_SECONDS:
+                COMMANDS.inc(command=command, source=trace.source, result="debounced")
+                log(f"Ignoring button press {(pressed - self.last_press) * 1000:.0f}ms after the last one",
+                    event="press_debounced")
+                done.set_result(True)
+                return done
+            self.last_press = pressed
+        self.commands.put_nowait((command, done, trace))
+        return done
+
+    async def run(self):
+        """Handle queued commands one at a time, folding together whatever queued up meanwhile."""
+        while True:
+            batch = [await self.commands.get()]
+            while not self.commands.empty():
+                batch.append(self.commands.get_nowait())
             try:
-                self.process.terminate()
-                self.process.wait(timeout=5)
+                await self.handle(batch)
             except Exception as e:
-                log(f"Warning: Error stopping arecord: {str(e)}")
-        if self.encoder_process:
+                log(f"Error handling {', '.join(command for command, _, _ in batch)}: {str(e)}")
+                for _, done, _ in batch:
+                    if not done.done():
+                        done.set_result(False)
+
+    async def handle(self, batch):
+        want = self.recording
+        for command, _, _ in batch:
+            want = {"start": True, "stop": False}.get(command, not want)
+        _, _, trace = batch[0]
+        trace.mark("dispatch")
+        if len(batch) > 1:
+            log(f"Folded {len(batch)} queued commands into one: {'start' if want else 'stop'}"
+                + (" (no change)" if want == self.recording else ""),
+                event="commands_coalesced", commands=[command for command, _, _ in batch])
+        if want != self.recording:
+            await (self.start(trace) if want else self.stop(trace))
+        for index, (command, done, trace) in enumerate(batch):
+            ok = self.recording == want
+            COMMANDS.inc(command=command, source=trace.source, result=("ok" if ok else "failed") if index == 0 else "coalesced")
+            if not done.done():
+                done.set_result(ok)
+
+    async def start(self, trace=None):
+        if self.state != IDLE:
+            return False
+
+        self.state = STARTING
+        started = time.monotonic()
+        trace = trace or tracer.begin("start", "internal")
+        trace.action = "start"
+        trace.mark("start")
+        try:
+            running = [capture for capture in self.captures if capture.is_running()]
+            for capture in self.captures:
+                if capture not in running:
+                    await capture.stop()
+            if Config.PREROLL_SECONDS > 0 and len(running) < len(await self.recording_devices()):
+                log("Pre-roll capture is not running on every device, those start without pre-roll",
+                    event="preroll_unavailable")
+            self.captures = await self.start_captures(max(Config.PREROLL_SECONDS, 0), running=running)
+            if self.capture.spawned_at >= trace.marks["start"]:
+                trace.mark("capture_spawned", self.capture.spawned_at)
+
+            encoder = get_encoder(Config.ENCODER)
+            rate = sum(encoder.estimated_rate(capture.bytes_per_second) for capture in self.captures)
+            if not self.storage.check_before_start(rate):
+                raise RuntimeError("not enough free space")
+            if self.transcoder:
+                # Keep background encoding off the CPU while capturing
+                self.transcoder.pause()
+            multiple = len(self.captures) > 1
+            self.file_time = datetime.now()
+            self.take_started = time.time()
+            self.takes = [
+                Take(capture, partial(self.create_recording_file, label=device_label(capture.device) if multiple else None),
+                     encoder,
+                     on_limit=self.on_max_recording_time,
+                     on_segment_opened=partial(self.on_segment_opened, capture),
+                     on_segment_finished=self.on_segment_finished,
+                     on_failed=partial(self.on_take_failed, capture),
+                     peaks=Config.PEAKS and level_meter_available())
+                for capture in self.captures
+            ]
             try:
-                # After arecord ends, lame should finish encoding
-                self.encoder_process.wait(timeout=10)
-            except Exception as e:
-                try:
-                    self.encoder_process.terminate()
-                except:
-                    pass
-                log(f"Warning: Error stopping lame: {str(e)}")
-        log("Recording stopped")
-        self.process = None
-        self.encoder_process = None
-    
-    async def toggle(self):
+                await asyncio.gather(*(take.open() for take in self.takes))
+            finally:
+                # Later segments are named for when they start
+                file_time, self.file_time = self.file_time, None
+            trace.mark("encoder_spawned", self.take.spawned_at)
+            for capture, take in zip(self.captures, self.takes):
+                capture.on_overrun = take.on_overrun
+
+            # Attach every device in the same event loop tick so the files start together
+            started_ns = time.time_ns()
+            preroll_bytes = [capture.attach(take) for capture, take in zip(self.captures, self.takes)]
+            if multiple:
+                self.take_info = {
+                    "started_at": started_ns,
+                    "devices": [{
+                        "device": capture.device or "default",
+                        "format": capture.audio_format,
+                        "channels": capture.channels,
+                        "sample_rate": Config.SAMPLE_RATE,
+                        "preroll_seconds": round(preroll / capture.bytes_per_second, 6),
+                        # Wall clock of each file's first sample, from when the last block before it
+                        # was read; align more precisely by cross-correlating the files
+                        "first_sample_at": (capture.read_ns or started_ns)
+                                           - round(preroll / capture.bytes_per_second * 1e9),
+                    } for capture, preroll in zip(self.captures, preroll_bytes)],
+                }
+                self.take_info_file = os.path.join(
+                    Config.RECORDING_DIR,
+                    f"{Config.RECORDING_PREFIX}-{file_time.strftime(Config.TIMESTAMP_FORMAT)}.take.json")
+
+            ready = await asyncio.gather(*(self.wait_until_ready(capture, take)
+                                           for capture, take in zip(self.captures, self.takes)))
+            if not any(ready):
+                encoder_err = await self.take.encoder_error()
+                raise RuntimeError(f"capture running: {self.capture.is_running()}, encoder err: {encoder_err}")
+            for capture, take, ok in list(zip(self.captures, self.takes, ready)):
+                if not ok:
+                    log(f"Recording on {capture.device} failed to start, continuing without it: "
+                        f"{await take.encoder_error()}", event="device_failed", device=capture.device)
+                    if self.take_info:
+                        self.take_info["devices"] = [device for device in self.take_info["devices"]
+                                                     if device["device"] != capture.device]
+                    await self.drop_device(capture, take)
+            preroll_bytes = [preroll for preroll, ok in zip(preroll_bytes, ready) if ok]
+            trace.mark("first_pcm", self.capture.delivered_at)
+            self.write_take_info()
+
+            if Config.LEVEL_METER and level_meter_available():
+                self.meter = LevelMeter(self.capture.audio_format, self.capture.channels,
+                                        on_level=self.level_listener, on_silence=self.on_silence)
+                self.meter.start()
+                self.capture.tap = self.meter.feed
+
+            filename = self.take.filename
+            devices = {}
+            if multiple:
+                devices = {"devices": [capture.device for capture in self.captures],
+                           "files": [take.filename for take in self.takes]}
+            on = f" on {len(self.captures)} devices" if len(self.captures) > 1 else ""
+            preroll = preroll_bytes[0] / self.capture.bytes_per_second
+            if preroll_bytes[0]:
+                log(f"Recording ({encoder.name}) started successfully{on} with {preroll:.1f}s pre-roll",
+                    event="recording_started", file=filename, encoder=encoder.name, preroll=round(preroll, 2),
+                    **devices)
+            else:
+                log(f"Recording ({encoder.name}) started successfully{on}",
+                    event="recording_started", file=filename, encoder=encoder.name, **devices)
+        except Exception as e:
+            log(f"Recording failed to start: {str(e)}", event="recording_failed")
+            RECORDINGS.inc(result="failed")
+            await self.shutdown_pipeline()
+            self.state = IDLE
+            self.takes = []
+            self.take_info = self.take_info_file = None
+            self.replicate_pending = []
+            trace.action = "failed_start"
+            trace.end()
+            return False
+
+        self.state = RECORDING
+        self.storage.watch(self.takes, self.on_low_space)
+        RECORDINGS.inc(result="started")
+        START_SECONDS.observe(time.monotonic() - started)
+        trace.expect("first_encoded")
+        self.output_watch = asyncio.create_task(self.watch_first_output(self.take, trace))
+
+        # Only control light after recording starts successfully
+        if self.light:
+            trace.expect("light")
+            self.light_trace = trace
+            self.light.set_recording(True)
+        trace.end()
+        return True
+
+    def on_max_recording_time(self):
         if self.recording:
-            await self.stop()
+            self.submit("stop", tracer.begin("stop", "max_time"))
+
+    def on_low_space(self):
+        if self.recording:
+            log("Stopping recording before the disk fills up", event="storage_stop")
+            self.submit("stop", tracer.begin("stop", "storage"))
+
+    def on_silence(self):
+        if self.recording and Config.SILENCE_STOP_SECONDS > 0:
+            log("Stopping recording after prolonged silence", event="silence_stop")
+            self.submit("stop", tracer.begin("stop", "silence"))
+
+    def on_take_failed(self, capture):
+        """No encoder is left for a device's audio: stop rather than keep the light on over nothing."""
+        if not self.recording:
+            return
+        if all(take.failed for take in self.takes):
+            self.submit("stop", tracer.begin("stop", "encoder_failed"))
         else:
-            await self.start()
+            log(f"Recording on {capture.device} failed, continuing on the other devices",
+                event="device_failed", device=capture.device)
+
+    def on_segment_opened(self, capture, output, encoder):
+        self.storage.preallocate_segment(output, encoder.estimated_rate(capture.bytes_per_second))
+        if self.catalog:
+            self.catalog.submit(self.catalog.started, output.name[:-len(PART_SUFFIX)], self.take_started, time.time(),
+                                capture.device or "default", capture.audio_format, capture.channels, encoder.name)
+
+    def on_segment_finished(self, filename, encoder, seconds):
+        if self.catalog:
+            self.catalog.submit(self.catalog.finished, filename, round(seconds, 3), time.time())
+        if self.transcoder and encoder.name != Config.TRANSCODE_TO:
+            # Mirrored once the transcode is done
+            self.transcode_pending.append(filename)
+        elif self.replicator:
+            self.replicate_pending.append(filename)
+        if self.replicator and os.path.exists(peaks_path(filename)):
+            self.replicate_pending.append(peaks_path(filename))
+
+    def on_transcoded(self, source, target, encoder_name, source_removed):
+        if self.catalog:
+            self.catalog.submit(self.catalog.transcoded, source, target, encoder_name, source_removed)
+        if self.replicator:
+            self.replicator.submit(target)
+
+    def replicate_take(self):
+        """Queue the files of the take that just stopped for mirroring to REPLICATE_TO."""
+        if self.take_info_file and os.path.exists(self.take_info_file):
+            self.replicate_pending.append(self.take_info_file)
+        for filename in self.replicate_pending:
+            self.replicator.submit(filename)
+        self.replicate_pending = []
+
+    def segment(self):
+        """Roll the current recording over to a new file without a gap."""
+        if self.recording and self.takes:
+            for take in self.takes:
+                take.request_rollover()
+            return True
+        return False
+
+    async def shutdown_pipeline(self):
+        """Let the encoders drain and exit; stop capture unless it is kept for pre-roll."""
+        self.storage.stop_watching()
+        for capture in self.captures:
+            capture.detach()
+            capture.on_overrun = None
+            capture.tap = None
+        if self.meter:
+            self.meter.close()
+            self.meter = None
+        await asyncio.gather(*(take.close() for take in self.takes))
+        kept = []
+        for capture in self.captures:
+            if capture.preroll is None or not capture.is_running():
+                await capture.stop()
+            else:
+                kept.append(capture)
+        self.captures = kept
+        if self.transcoder:
+            for filename in self.transcode_pending:
+                self.transcoder.submit(filename, Config.TRANSCODE_TO)
+            self.transcode_pending = []
+            self.transcoder.resume()
+        if Config.PREROLL_SECONDS > 0:
+            await self.restore_preroll()
+
+    async def restore_preroll(self):
+        """Restart pre-roll capture on devices whose capture died or was never started."""
+        try:
+            self.captures = await self.start_captures(Config.PREROLL_SECONDS, running=self.captures)
+        except Exception as e:
+            log(f"Could not restart pre-roll capture, the next take starts without it: {str(e)}",
+                event="preroll_unavailable")
+
+    async def stop(self, trace=None):
+        if self.state != RECORDING:
+            return
+
+        trace = trace or tracer.begin("stop", "internal")
+        trace.action = "stop"
+        trace.mark("stop")
+        # Turn off light before stopping recording
+        if self.light:
+            trace.expect("light")
+            self.light_trace = trace
+            self.light.set_recording(False)
+
+        self.state = STOPPING
+        await self.shutdown_pipeline()
+        trace.mark("pipeline_stopped")
+        self.write_take_info()
+        if self.replicator:
+            self.replicate_take()
+        take = self.take
+        segments = [filename for take in self.takes for filename in take.segments]
+        self.takes = []
+        self.take_info = self.take_info_file = None
+        self.state = IDLE
+        log("Recording stopped", event="recording_stopped", files=segments,
+            seconds=round(take.total_bytes / take.capture.bytes_per_second, 2) if take else 0)
+        trace.end()
 
     def is_recording(self):
-        return self.recording
\ No newline at end of file
+        return self.recording
+
+    def status(self):
+        status = {"recording": self.recording, "state": self.state, "light": self.light is not None}
+        take = self.take
+        if take:
+            status.update(
+                file=take.filename,
+                segments=len(take.segments),
+                encoder=take.segment_encoder.name if take.segment_encoder else None,
+                seconds=round(take.total_bytes / take.capture.bytes_per_second, 1),
+            )
+            if len(self.takes) > 1:
+                status["devices"] = [{"device": take.capture.device, "file": take.filename}
+                                     for take in self.takes]
+        if self.meter:
+            status.update(rms_db=round(self.meter.rms_db, 1), peak_db=round(self.meter.peak_db, 1))
+        return status
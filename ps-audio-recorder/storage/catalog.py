@@ -0,0 +1,241 @@
+"""Index of the recordings in RECORDING_DIR.
+
+The recorder adds a row when a file is opened and completes it when the file
+is finalized, with the duration counted from the PCM actually captured, so
+listing takes never needs to open the audio.
+
+    python -m storage.catalog                      # newest first
+    python -m storage.catalog --since 2026-01-01 --min-duration 600
+    python -m storage.catalog --summary
+    python -m storage.catalog --reconcile          # pick up files copied in or deleted by hand
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import sqlite3
+import struct
+import sys
+from datetime import datetime
+
+from utils.logging import log
+from config import Config
+from storage.partial import PART_SUFFIX, wav_data_offset
+from storage.space import RECORDING_EXTENSIONS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    path TEXT PRIMARY KEY,
+    take_started REAL,  -- shared by the segments and devices of one take
+    started_at REAL,
+    stopped_at REAL,
+    duration REAL,  -- seconds of audio; NULL when unknown (e.g. MP3s the recorder didn't write)
+    bytes INTEGER,
+    device TEXT,
+    format TEXT,
+    channels INTEGER,
+    sample_rate INTEGER,
+    encoder TEXT,
+    status TEXT  -- recording, complete, recovered, external
+);
+CREATE INDEX IF NOT EXISTS recordings_started ON recordings (started_at);
+"""
+
+def header_duration(path):
+    """Duration from a WAV or FLAC header, without decoding; None for other files."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(64)
+            if head[:4] == b"fLaC" and len(head) >= 26:
+                # STREAMINFO: 20-bit sample rate ... 36-bit total samples
+                packed = int.from_bytes(head[18:26], "big")
+                rate, samples = packed >> 44, packed & 0xFFFFFFFFF
+                return samples / rate if rate and samples else None
+            if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+                offset = wav_data_offset(path)
+                fmt = head.find(b"fmt ")
+                if offset is None or fmt < 0:
+                    return None
+                byte_rate = struct.unpack("<I", head[fmt + 16:fmt + 20])[0]
+                return (os.path.getsize(path) - offset) / byte_rate if byte_rate else None
+    except (OSError, struct.error):
+        pass
+    return None
+
+class Catalog:
+    """SQLite index of recordings, kept next to the audio device cache.
+
+    Writes from the recorder go through submit(), which runs them in order on
+    one background thread so a slow SD card never holds up capture."""
+
+    def __init__(self, path=None, directory=None):
+        self.path = path or Config.CATALOG_FILE
+        self.directory = directory or Config.RECORDING_DIR
+        self.db = None
+        self.executor = None
+
+    def open(self, readonly=False):
+        if readonly:
+            self.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        else:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(SCHEMA)
+        self.db.row_factory = sqlite3.Row
+
+    def submit(self, method, *args):
+        """Run method(*args) on the catalog thread; errors are logged, never raised."""
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog")
+        future = asyncio.get_running_loop().run_in_executor(self.executor, method, *args)
+        future.add_done_callback(self.log_error)
+        return future
+
+    def log_error(self, future):
+        if not future.cancelled() and future.exception():
+            log(f"Error updating recordings catalog: {str(future.exception())}")
+
+    def started(self, path, take_started, started_at, device, audio_format, channels, encoder):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO recordings (path, take_started, started_at, device, format, channels,"
+                " sample_rate, encoder, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'recording')",
+                (path, take_started, started_at, device, audio_format, channels, Config.SAMPLE_RATE, encoder))
+
+    def finished(self, path, duration, stopped_at):
+        size = os.path.getsize(path)
+        with self.db:
+            self.db.execute(
+                "UPDATE recordings SET stopped_at = ?, duration = ?, bytes = ?, status = 'complete' WHERE path = ?",
+                (stopped_at, duration, size, path))
+
+    def transcoded(self, source, target, encoder, source_removed):
+        size = os.path.getsize(target)
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO recordings SELECT ?, take_started, started_at, stopped_at, duration, ?,"
+                " device, format, channels, sample_rate, ?, status FROM recordings WHERE path = ?",
+                (target, size, encoder, source))
+            if source_removed:
+                self.db.execute("DELETE FROM recordings WHERE path = ?", (source,))
+
+    def removed(self, path):
+        with self.db:
+            self.db.execute("DELETE FROM recordings WHERE path = ?", (path,))
+
+    def reconcile(self):
+        """Bring the catalog in line with RECORDING_DIR: add files the recorder
+        didn't write, drop rows for files that are gone, and settle takes that
+        were interrupted. Returns (added, removed, updated)."""
+        on_disk = {}
+        for entry in os.scandir(self.directory):
+            if (entry.is_file() and entry.name.startswith(Config.RECORDING_PREFIX)
+                    and entry.name.endswith(RECORDING_EXTENSIONS)):
+                on_disk[entry.path] = entry.stat()
+        added = removed = updated = 0
+        with self.db:
+            for row in self.db.execute("SELECT path, bytes, status FROM recordings").fetchall():
+                stat = on_disk.pop(row["path"], None)
+                if stat is None:
+                    if row["status"] == "recording" and os.path.exists(row["path"] + PART_SUFFIX):
+                        continue  # still being written
+                    self.db.execute("DELETE FROM recordings WHERE path = ?", (row["path"],))
+                    removed += 1
+                elif row["status"] == "recording":
+                    # Salvaged by recover_partial_recordings after a crash
+                    self.db.execute(
+                        "UPDATE recordings SET status = 'recovered', bytes = ?, stopped_at = ?, duration = ?"
+                        " WHERE path = ?", (stat.st_size, stat.st_mtime, header_duration(row["path"]), row["path"]))
+                    updated += 1
+                elif row["bytes"] != stat.st_size:
+                    self.db.execute("UPDATE recordings SET bytes = ? WHERE path = ?", (stat.st_size, row["path"]))
+                    updated += 1
+            for path, stat in on_disk.items():
+                self.db.execute(
+                    "INSERT INTO recordings (path, started_at, stopped_at, duration, bytes, encoder, status)"
+                    " VALUES (?, ?, ?, ?, ?, ?, 'external')",
+                    (path, stat.st_mtime, stat.st_mtime, header_duration(path), stat.st_size,
+                     os.path.splitext(path)[1][1:]))
+                added += 1
+        return added, removed, updated
+
+    def query(self, since=None, until=None, device=None, status=None, min_duration=None, limit=None):
+        clauses, params = [], []
+        for clause, value in (("started_at >= ?", since), ("started_at < ?", until), ("device = ?", device),
+                              ("status = ?", status), ("duration >= ?", min_duration)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        sql = "SELECT * FROM recordings"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY started_at DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [dict(row) for row in self.db.execute(sql, params)]
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.db:
+            self.db.close()
+            self.db = None
+
+def parse_time(value):
+    return datetime.fromisoformat(value).timestamp()
+
+def format_duration(seconds):
+    if seconds is None:
+        return "?"
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List recordings from the catalog without opening the audio files.")
+    parser.add_argument("--since", type=parse_time, help="YYYY-MM-DD[ HH:MM]")
+    parser.add_argument("--until", type=parse_time, help="YYYY-MM-DD[ HH:MM]")
+    parser.add_argument("--device", help="e.g. hw:1,0")
+    parser.add_argument("--status", choices=("recording", "complete", "recovered", "external"))
+    parser.add_argument("--min-duration", type=float, help="seconds")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--json", action="store_true", help="one JSON object per line")
+    parser.add_argument("--summary", action="store_true", help="only totals")
+    parser.add_argument("--reconcile", action="store_true", help="scan RECORDING_DIR first (needs write access)")
+    parser.add_argument("--db", default=Config.CATALOG_FILE)
+    parser.add_argument("--dir", default=Config.RECORDING_DIR, help="recordings directory to reconcile")
+    args = parser.parse_args(argv)
+
+    catalog = Catalog(args.db, args.dir)
+    try:
+        catalog.open(readonly=not args.reconcile)
+    except sqlite3.Error as e:
+        print(f"Cannot open {args.db}: {e}", file=sys.stderr)
+        return 1
+    try:
+        if args.reconcile:
+            added, removed, updated = catalog.reconcile()
+            print(f"Reconciled: {added} added, {removed} removed, {updated} updated", file=sys.stderr)
+        rows = catalog.query(args.since, args.until, args.device, args.status, args.min_duration, args.limit)
+    finally:
+        catalog.close()
+
+    if args.summary:
+        total = sum(row["duration"] or 0 for row in rows)
+        size = sum(row["bytes"] or 0 for row in rows)
+        print(f"{len(rows)} recordings, {format_duration(total)}, {size / 1e9:.2f} GB")
+    elif args.json:
+        for row in rows:
+            print(json.dumps(row))
+    else:
+        for row in rows:
+            started = datetime.fromtimestamp(row["started_at"]).strftime("%Y-%m-%d %H:%M:%S") if row["started_at"] else "?"
+            print(f"{started}  {format_duration(row['duration']):>9}  {(row['bytes'] or 0) / 1e6:8.1f} MB  "
+                  f"{row['device'] or '-':<8} {row['encoder'] or '-':<12} {row['status']:<9} {os.path.basename(row['path'])}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
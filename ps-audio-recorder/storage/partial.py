@@ -0,0 +1,102 @@
+import os
+import struct
+
+from utils.logging import log
+from config import Config
+from pipeline.encoders import ENCODERS
+
+PART_SUFFIX = ".part"
+
+def part_path(filename):
+    """Where a recording is written until it is finalized."""
+    return filename + PART_SUFFIX
+
+def fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def sync_file(fileobj):
+    """fdatasync through a duplicate fd, so a concurrent close can't pull it out from under us."""
+    fd = os.dup(fileobj.fileno())
+    try:
+        os.fdatasync(fd)
+    finally:
+        os.close(fd)
+
+def finalize_part(output, part, filename):
+    """Flush a finished .part file to disk and atomically rename it to filename."""
+    try:
+        # Give back space preallocated past what the encoder wrote
+        os.ftruncate(output.fileno(), os.fstat(output.fileno()).st_size)
+        os.fdatasync(output.fileno())
+    finally:
+        output.close()
+    os.replace(part, filename)
+    fsync_directory(os.path.dirname(filename) or ".")
+
+def wav_data_offset(path):
+    """Offset of the PCM data in a WAV file, or None if the header is incomplete."""
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            return None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            size = struct.unpack("<I", chunk[4:8])[0]
+            if chunk[:4] == b"data":
+                return f.tell()
+            f.seek(size + (size & 1), os.SEEK_CUR)
+
+def recovered_name(filename):
+    if not os.path.exists(filename):
+        return filename
+    stem, extension = os.path.splitext(filename)
+    suffix = 1
+    while os.path.exists(f"{stem}-recovered-{suffix}{extension}"):
+        suffix += 1
+    return f"{stem}-recovered-{suffix}{extension}"
+
+def recover_partial_recordings(directory=None):
+    """Salvage .part files left by a crash or power cut; returns the recovered paths.
+
+    Encoder output streamed to a file is playable up to where it stopped, so
+    recovery renames it into place; WAV files also get their sizes patched.
+    Files with no audio in them are removed."""
+    directory = directory or Config.RECORDING_DIR
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.endswith(PART_SUFFIX))
+    except Exception as e:
+        log(f"Error scanning {directory} for partial recordings: {str(e)}")
+        return []
+
+    recovered = []
+    for name in names:
+        part = os.path.join(directory, name)
+        filename = part[:-len(PART_SUFFIX)]
+        try:
+            size = os.path.getsize(part)
+            os.truncate(part, size)  # drop any preallocated tail
+            header_bytes = 0
+            if filename.endswith(".wav"):
+                header_bytes = wav_data_offset(part) or size
+                if size > header_bytes:
+                    ENCODERS["wav"].finalize(part, header_bytes)
+            if size <= header_bytes:
+                os.remove(part)
+                log(f"Removed empty partial recording {part}")
+                continue
+            target = recovered_name(filename)
+            os.replace(part, target)
+            recovered.append(target)
+            log(f"Recovered interrupted recording {target} ({size} bytes)",
+                event="recording_recovered", file=target, bytes=size)
+        except Exception as e:
+            log(f"Error recovering {part}: {str(e)}")
+    if recovered:
+        fsync_directory(directory)
+    return recovered
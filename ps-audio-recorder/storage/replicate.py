@@ -0,0 +1,251 @@
+import asyncio
+import errno
+import hashlib
+import json
+import os
+import time
+
+from utils.logging import log
+from config import Config
+from storage.partial import fsync_directory
+
+PARTIAL_SUFFIX = ".replicating"
+MB = 1024 * 1024
+
+def copy_chunk(source, target, offset, count, use_sendfile=False):
+    """Copy up to count bytes at offset from source into target without going
+    through user space; returns bytes copied (0 at the end of source)."""
+    source_fd = os.open(source, os.O_RDONLY)
+    try:
+        target_fd = os.open(target, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.lseek(target_fd, offset, os.SEEK_SET)
+            if use_sendfile:
+                return os.sendfile(target_fd, source_fd, offset, count)
+            return os.copy_file_range(source_fd, target_fd, count, offset)
+        finally:
+            os.close(target_fd)
+    finally:
+        os.close(source_fd)
+
+def sync_path(path):
+    """fsync path and drop it from the page cache, so verifying it reads what was written."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def read_chunk(path, offset, count):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(count)
+
+class Replicator:
+    """Mirrors finished recordings to REPLICATE_TO in the background.
+
+    Jobs are JSON files in REPLICATE_QUEUE_DIR and copies go to a .replicating
+    file that is picked up where it stopped, so a crash, reboot or NAS outage
+    only costs the chunk in flight. Copies are throttled to REPLICATE_RATE_MB
+    (REPLICATE_RECORDING_RATE_MB while busy() is true, e.g. while recording)
+    and checked with SHA-256 against the source before they are renamed into
+    place."""
+
+    def __init__(self, target_dir=None, queue_dir=None, busy=None):
+        self.target_dir = target_dir or Config.REPLICATE_TO
+        self.queue_dir = queue_dir or Config.REPLICATE_QUEUE_DIR
+        self.busy = busy or (lambda: False)
+        self.jobs = asyncio.Queue()
+        self.worker_task = None
+        self.next_at = 0.0  # monotonic time the next chunk may start
+        self.use_sendfile = False  # copy_file_range refused this pair of filesystems
+        self.target_missing = False
+
+    def start(self):
+        try:
+            os.makedirs(self.queue_dir, exist_ok=True)
+            pending = [os.path.join(self.queue_dir, name) for name in os.listdir(self.queue_dir)
+                       if name.endswith(".json")]
+        except Exception as e:
+            log(f"Error opening replication queue: {str(e)}")
+            pending = []
+        for job_path in sorted(pending, key=os.path.getmtime):
+            self.jobs.put_nowait(job_path)
+        if pending:
+            log(f"Resuming {len(pending)} pending replication jobs")
+        self.worker_task = asyncio.create_task(self.worker())
+
+    def submit(self, source):
+        job = {"source": source, "created": time.time(), "attempts": 0}
+        job_path = os.path.join(self.queue_dir, os.path.basename(source) + ".json")
+        try:
+            self.write_job(job_path, job)
+        except Exception as e:
+            log(f"Error queueing replication of {source}: {str(e)}")
+            return
+        self.jobs.put_nowait(job_path)
+
+    def write_job(self, job_path, job):
+        tmp_path = job_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, job_path)
+
+    def rate(self):
+        """Bytes per second allowed right now; None for no limit, 0 to hold off."""
+        limit = Config.REPLICATE_RECORDING_RATE_MB if self.busy() else Config.REPLICATE_RATE_MB
+        return None if limit is None else int(limit * MB)
+
+    async def throttle(self, size):
+        """Wait until size more bytes fit within the current rate."""
+        rate = self.rate()
+        while rate == 0:
+            await asyncio.sleep(1)
+            rate = self.rate()
+        now = time.monotonic()
+        if rate is None:
+            self.next_at = now
+            return
+        if self.next_at > now:
+            await asyncio.sleep(self.next_at - now)
+            now = time.monotonic()
+        self.next_at = now + size / rate
+
+    def chunk_size(self):
+        # Short bursts at the low rate keep each one from stalling the card for long
+        rate = self.rate()
+        chunk = Config.REPLICATE_CHUNK_MB * MB
+        return max(64 * 1024, min(chunk, rate // 4)) if rate else chunk
+
+    async def worker(self):
+        while True:
+            job_path = await self.jobs.get()
+            try:
+                await self.run_job(job_path)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log(f"Error running replication job {job_path}: {str(e)}")
+
+    async def run_job(self, job_path):
+        try:
+            with open(job_path, "r") as f:
+                job = json.load(f)
+        except FileNotFoundError:
+            return
+        source = job["source"]
+        if not os.path.exists(source):
+            log(f"Replication source {source} is gone, dropping job")
+            os.remove(job_path)
+            return
+        if not os.path.isdir(self.target_dir):
+            # NAS not mounted (yet); keep the job and try again later
+            if not self.target_missing:
+                log(f"Replication target {self.target_dir} is not available, will retry")
+                self.target_missing = True
+            self.retry_later(job_path)
+            return
+        self.target_missing = False
+
+        target = os.path.join(self.target_dir, os.path.basename(source))
+        partial = target + PARTIAL_SUFFIX
+        stat = os.stat(source)
+        if job.get("size") != stat.st_size or job.get("mtime") != stat.st_mtime:
+            # New job, or the source changed since the copy started
+            job.update(size=stat.st_size, mtime=stat.st_mtime, sha256=None)
+            if os.path.exists(partial):
+                os.remove(partial)
+            self.write_job(job_path, job)
+
+        started = time.monotonic()
+        try:
+            resumed = await self.copy(source, partial, stat.st_size)
+            if job["sha256"] is None:
+                job["sha256"] = await self.digest(source)
+                self.write_job(job_path, job)
+            copied = await self.digest(partial)
+        except OSError as e:
+            log(f"Error replicating {source}: {str(e)}")
+            self.failed(job_path, job)
+            return
+        if copied != job["sha256"]:
+            log(f"Checksum mismatch replicating {source}, copying it again")
+            os.remove(partial)
+            self.failed(job_path, job)
+            return
+
+        os.utime(partial, (stat.st_atime, stat.st_mtime))
+        os.replace(partial, target)
+        fsync_directory(self.target_dir)
+        os.remove(job_path)
+        elapsed = time.monotonic() - started
+        resumed_note = f", resumed at {resumed / MB:.1f} MB" if resumed else ""
+        log(f"Replicated {target} ({stat.st_size / MB:.1f} MB in {elapsed:.1f}s{resumed_note})",
+            event="replicate_done", file=target, bytes=stat.st_size, seconds=round(elapsed, 1))
+
+    async def copy(self, source, partial, size):
+        """Copy source to partial from wherever a previous attempt got to; returns that offset."""
+        loop = asyncio.get_running_loop()
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        if offset > size:
+            os.remove(partial)
+            offset = 0
+        resumed = offset
+        while offset < size:
+            count = min(self.chunk_size(), size - offset)
+            await self.throttle(count)
+            try:
+                copied = await loop.run_in_executor(None, copy_chunk, source, partial, offset, count, self.use_sendfile)
+            except OSError as e:
+                if self.use_sendfile or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+                # copy_file_range can't cross these filesystems; sendfile can
+                self.use_sendfile = True
+                continue
+            if not copied:
+                raise OSError(errno.EIO, f"{source} ended at {offset} of {size} bytes")
+            offset += copied
+        if not os.path.exists(partial):
+            open(partial, "wb").close()  # empty source
+        await loop.run_in_executor(None, sync_path, partial)
+        return resumed
+
+    async def digest(self, path):
+        """SHA-256 of path, read at the same throttled rate as the copy."""
+        loop = asyncio.get_running_loop()
+        sha = hashlib.sha256()
+        offset = 0
+        while True:
+            count = self.chunk_size()
+            await self.throttle(count)
+            data = await loop.run_in_executor(None, read_chunk, path, offset, count)
+            if not data:
+                return sha.hexdigest()
+            sha.update(data)
+            offset += len(data)
+
+    def failed(self, job_path, job):
+        job["attempts"] += 1
+        if job["attempts"] >= Config.REPLICATE_MAX_ATTEMPTS:
+            log(f"Giving up on replicating {job['source']} after {job['attempts']} attempts",
+                event="replicate_failed", file=job["source"])
+            os.replace(job_path, job_path[:-len(".json")] + ".failed")
+            return
+        self.write_job(job_path, job)
+        self.retry_later(job_path)
+
+    def retry_later(self, job_path):
+        asyncio.get_running_loop().call_later(Config.REPLICATE_RETRY_SECONDS, self.jobs.put_nowait, job_path)
+
+    async def close(self):
+        """Stop the worker; unfinished copies stay on disk and resume on the next start."""
+        if self.worker_task:
+            self.worker_task.cancel()
+            try:
+                await self.worker_task
+            except asyncio.CancelledError:
+                pass
+            self.worker_task = None
@@ -0,0 +1,161 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+
+from utils.logging import log
+from utils.metrics import metrics
+from config import Config
+from storage.partial import PART_SUFFIX
+from pipeline.peaks import peaks_path
+
+FALLOC_FL_KEEP_SIZE = 0x01
+RECORDING_EXTENSIONS = (".mp3", ".flac", ".wav")
+
+FREE_BYTES = metrics.gauge("recorder_storage_free_bytes", "Free space in RECORDING_DIR")
+RETENTION_DELETED = metrics.counter("recorder_retention_deleted_total", "Recordings deleted to free space")
+
+_fallocate = None
+
+def load_fallocate():
+    global _fallocate
+    if _fallocate is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        # fallocate64 takes 64-bit offsets even on 32-bit Raspberry Pi OS
+        _fallocate = getattr(libc, "fallocate64", None) or libc.fallocate
+        _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+        _fallocate.restype = ctypes.c_int
+    return _fallocate
+
+def preallocate(fd, length):
+    """Reserve blocks for length bytes without changing the file size (FALLOC_FL_KEEP_SIZE)."""
+    if load_fallocate()(fd, FALLOC_FL_KEEP_SIZE, 0, length) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"fallocate failed: {os.strerror(errno)}")
+
+def release_preallocation(fd):
+    """Give back blocks reserved past the end of the file."""
+    os.ftruncate(fd, os.fstat(fd).st_size)
+
+def free_bytes(directory=None):
+    stat = os.statvfs(directory or Config.RECORDING_DIR)
+    return stat.f_bavail * stat.f_frsize
+
+class StorageManager:
+    """Keeps RECORDING_DIR from filling up.
+
+    Checks the space a take will need before it starts, preallocates each
+    segment so flash sees fewer, larger allocations, and watches free space
+    while recording: oldest recordings are deleted first when retention is
+    enabled, otherwise on_low_space is called so the take can stop cleanly."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or Config.RECORDING_DIR
+        self.reserve = Config.STORAGE_RESERVE_MB * 1024 * 1024
+        self.protected = set()  # files of the current take
+        self.task = None
+        self.on_deleted = None  # called with the path of each recording deleted for space
+
+    def available(self):
+        """Bytes usable for recordings, after the reserve."""
+        free = free_bytes(self.directory)
+        FREE_BYTES.set(free)
+        return free - self.reserve
+
+    def check_before_start(self, rate):
+        """rate is the estimated encoded bytes per second. Returns False when
+        there is not even STORAGE_MIN_FREE_SECONDS of room.
+
+        Retention only deletes enough here to reach STORAGE_MIN_FREE_SECONDS;
+        anything more is left to the watcher, once the take actually needs it."""
+        needed = int(rate * Config.MAX_RECORDING_TIME)
+        minimum = int(rate * Config.STORAGE_MIN_FREE_SECONDS)
+        available = self.available()
+        if available < minimum and Config.STORAGE_RETENTION:
+            self.delete_oldest(minimum - available)
+            available = self.available()
+        seconds = max(0, available) / rate
+        if seconds < Config.STORAGE_MIN_FREE_SECONDS:
+            log(f"Not enough free space in {self.directory}: room for {seconds:.0f}s of audio",
+                event="storage_full", seconds=round(seconds))
+            return False
+        if available < needed:
+            log(f"Warning: only room for {seconds / 60:.0f} of {Config.MAX_RECORDING_TIME / 60:.0f} minutes of audio",
+                event="storage_low", seconds=round(seconds))
+        return True
+
+    def preallocate_segment(self, output, rate):
+        """Reserve space for a segment of SEGMENT_SECONDS (or MAX_RECORDING_TIME) at rate."""
+        if Config.STORAGE_PREALLOCATE_MB <= 0:
+            return
+        seconds = Config.SEGMENT_SECONDS if Config.SEGMENT_SECONDS > 0 else Config.MAX_RECORDING_TIME
+        length = min(int(rate * seconds), Config.STORAGE_PREALLOCATE_MB * 1024 * 1024)
+        try:
+            length = min(length, max(0, self.available()))
+            if length > 0:
+                preallocate(output.fileno(), length)
+        except OSError as e:
+            # Not every filesystem supports it (e.g. FAT on a USB stick); recording works without
+            log(f"Could not preallocate {output.name}: {str(e)}")
+
+    def recordings(self):
+        """Finished recordings in the directory, oldest first."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if (entry.is_file() and entry.name.startswith(Config.RECORDING_PREFIX)
+                    and entry.name.endswith(RECORDING_EXTENSIONS) and entry.path not in self.protected):
+                entries.append((entry.stat().st_mtime, entry.path, entry.stat().st_size))
+        entries.sort()
+        return entries
+
+    def delete_oldest(self, needed):
+        freed = 0
+        for _, path, size in self.recordings():
+            if freed >= needed:
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                log(f"Error deleting {path}: {str(e)}")
+                continue
+            freed += size
+            try:
+                os.remove(peaks_path(path))
+            except OSError:
+                pass
+            RETENTION_DELETED.inc()
+            if self.on_deleted:
+                self.on_deleted(path)
+            log(f"Deleted old recording {path} to free space", event="retention_deleted", file=path, bytes=size)
+        return freed
+
+    def watch(self, takes, on_low_space):
+        """Start checking free space every STORAGE_CHECK_INTERVAL seconds while takes record."""
+        self.stop_watching()
+        self.task = asyncio.create_task(self.run(takes, on_low_space))
+
+    async def run(self, takes, on_low_space):
+        while True:
+            await asyncio.sleep(Config.STORAGE_CHECK_INTERVAL)
+            try:
+                self.protected = {path for take in takes for name in take.segments
+                                  for path in (name, name + PART_SUFFIX)}
+                available = self.available()
+                if available >= 0:
+                    continue
+                if Config.STORAGE_RETENTION:
+                    self.delete_oldest(-available)
+                    if self.available() >= 0:
+                        continue
+                log(f"Free space in {self.directory} is below the {Config.STORAGE_RESERVE_MB}MB reserve",
+                    event="storage_full")
+                on_low_space()
+                return
+            except Exception as e:
+                log(f"Error checking free space: {str(e)}")
+
+    def stop_watching(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        self.protected = set()
@@ -0,0 +1,66 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+
+IN_ATTRIB = 0x00000004
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+class Inotify:
+    """Minimal inotify wrapper that reports (path, mask, name) events on the event loop."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1 failed: {os.strerror(errno)}")
+        self.watches = {}  # watch descriptor -> watched path
+        self.loop = None
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch({path}) failed: {os.strerror(errno)}")
+        self.watches[wd] = path
+        return wd
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="ignore")
+            offset += length
+            events.append((self.watches.get(wd), mask, name))
+        return events
+
+    def start(self, callback):
+        """Call callback(path, mask, name) for every event until close()."""
+        self.loop = asyncio.get_running_loop()
+
+        def on_readable():
+            for path, mask, name in self.read_events():
+                callback(path, mask, name)
+
+        self.loop.add_reader(self.fd, on_readable)
+
+    def close(self):
+        if self.fd < 0:
+            return
+        if self.loop:
+            self.loop.remove_reader(self.fd)
+        os.close(self.fd)
+        self.fd = -1
@@ -1,7 +1,149 @@
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
 from datetime import datetime
 from config import Config
 
-def log(message):
-    print(f"{datetime.now()}: {message}")
-    with open(Config.LOG_FILE, "a") as log_file:
-        log_file.write(f"{datetime.now()}: {message}\n")
+BATCH_SIZE = 256
+
+def format_text(timestamp, message, fields):
+    line = f"{timestamp}: {message}"
+    if fields:
+        line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+    return line + "\n"
+
+def format_json(timestamp, message, fields):
+    record = {"time": timestamp.isoformat(), "message": message}
+    record.update(fields)
+    return json.dumps(record, default=str) + "\n"
+
+def writes_to(stream, path):
+    """True when stream already ends up in path, e.g. systemd's StandardOutput=append:LOG_FILE."""
+    try:
+        stream_stat = os.fstat(stream.fileno())
+        path_stat = os.stat(path)
+    except (OSError, ValueError, AttributeError):
+        return False
+    return (stream_stat.st_dev, stream_stat.st_ino) == (path_stat.st_dev, path_stat.st_ino)
+
+class LogWriter(threading.Thread):
+    """Background thread that writes queued log records in batches, keeps the
+    log file open and rotates it by size, so callers never wait on disk."""
+
+    def __init__(self, path):
+        super().__init__(name="log-writer", daemon=True)
+        self.path = path
+        self.records = queue.SimpleQueue()
+        self.file = None
+        # Decided once: after a rotation stdout would still point at the renamed file
+        self.echo = not writes_to(sys.stdout, path)
+        self.rotate_failed = False  # reported once; the file then just keeps growing
+
+    def run(self):
+        while True:
+            batch = [self.records.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = None in batch
+            self.write([record for record in batch if record is not None])
+            if stopping:
+                self.close_file()
+                return
+
+    def write(self, batch):
+        if not batch:
+            return
+        if self.echo:
+            try:
+                sys.stdout.write("".join(format_text(*record) for record in batch))
+                sys.stdout.flush()
+            except Exception:
+                pass
+
+        formatter = format_json if Config.LOG_JSON else format_text
+        try:
+            if self.file is None:
+                self.file = open(self.path, "a")
+            self.file.write("".join(formatter(*record) for record in batch))
+            self.file.flush()
+            if self.file.tell() >= Config.LOG_MAX_BYTES and not self.rotate_failed:
+                try:
+                    self.rotate()
+                except OSError as e:
+                    self.rotate_failed = True
+                    self.report(f"Could not rotate log file {self.path}, it will keep growing: {e}")
+        except Exception as e:
+            self.close_file()
+            try:
+                sys.stderr.write(f"Error writing log file {self.path}: {e}\n")
+            except Exception:
+                pass
+
+    def report(self, message):
+        """A problem with the log itself: to stderr (the journal) and, if possible, the log."""
+        try:
+            sys.stderr.write(message + "\n")
+        except Exception:
+            pass
+        try:
+            if self.file is None:
+                self.file = open(self.path, "a")
+            formatter = format_json if Config.LOG_JSON else format_text
+            self.file.write(formatter(datetime.now(), message, {}))
+            self.file.flush()
+        except Exception:
+            self.close_file()
+
+    def rotate(self):
+        self.close_file()
+        for index in range(Config.LOG_BACKUP_COUNT - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if Config.LOG_BACKUP_COUNT > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.truncate(self.path, 0)
+
+    def close_file(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except Exception:
+                pass
+            self.file = None
+
+    def stop(self, timeout=2):
+        self.records.put(None)
+        self.join(timeout)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = LogWriter(Config.LOG_FILE)
+                _writer.start()
+                atexit.register(flush_log)
+    return _writer
+
+def flush_log():
+    """Write out everything queued so far and stop the writer thread."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.stop()
+
+def log(message, **fields):
+    """Queue a log line; extra keyword fields become JSON keys (or key=value in text)."""
+    get_writer().records.put((datetime.now(), message, fields))
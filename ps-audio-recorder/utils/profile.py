@@ -0,0 +1,57 @@
+import asyncio
+import contextlib
+import os
+import time
+
+from utils.logging import log
+from config import Config
+
+def process_age():
+    """Seconds since this process was created, including interpreter start-up."""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+class StartupProfile:
+    """Per-phase start-up timings, logged once start-up (including the
+    background phases after "Ready to record") has finished."""
+
+    def __init__(self):
+        self.phases = {}  # name -> seconds, in the order they finished
+        self.ready_after = None  # process age when the recorder became ready
+        self.reported = asyncio.Event()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, time.monotonic() - started)
+
+    def record(self, name, seconds):
+        self.phases[name] = round(seconds, 3)
+
+    def mark_ready(self):
+        self.ready_after = process_age()
+        if self.ready_after is not None:
+            log(f"Ready {self.ready_after:.2f}s after process start", event="startup_ready",
+                seconds=round(self.ready_after, 3))
+
+    def report(self):
+        if self.reported.is_set():
+            return
+        self.reported.set()
+        if not Config.STARTUP_PROFILE:
+            return
+        summary = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        ready = f"; ready after {self.ready_after:.2f}s" if self.ready_after is not None else ""
+        log(f"Startup profile: {summary}{ready}", event="startup_profile",
+            ready=self.ready_after and round(self.ready_after, 3), **self.phases)
+
+startup = StartupProfile()
@@ -0,0 +1,114 @@
+import ctypes
+import ctypes.util
+import os
+import shutil
+
+from utils.logging import log
+from config import Config
+
+MCL_CURRENT, MCL_FUTURE, MCL_ONFAULT = 1, 2, 4
+POLICY_NAMES = {os.SCHED_OTHER: "other", os.SCHED_FIFO: "fifo", os.SCHED_RR: "rr"}
+
+reported = set()  # (role, problems) already logged, so segments don't repeat them
+
+def pipeline_cpus(index):
+    """(capture cores, encoder cores) for the index-th device pipeline.
+
+    Core 0 handles USB interrupts and the event loop, so pipelines go
+    round-robin over the others when there are any; with two or more of
+    those, arecord and the encoder get a core each so a busy encoder can't
+    delay the capture wakeup."""
+    if not Config.PIPELINE_CPU_AFFINITY:
+        return None, None
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) > 1:
+        cpus = cpus[1:]
+    if len(cpus) == 1:
+        return set(cpus), set(cpus)
+    return {cpus[index * 2 % len(cpus)]}, {cpus[(index * 2 + 1) % len(cpus)]}
+
+def pin_process(pid, cpus):
+    if not cpus:
+        return
+    try:
+        os.sched_setaffinity(pid, cpus)
+    except OSError as e:
+        log(f"Could not set CPU affinity of {pid} to {sorted(cpus)}: {str(e)}")
+
+def encoder_command(command):
+    """Wrap an encoder command in ionice, like the transcode workers (nice is set after spawn)."""
+    if Config.ENCODER_IONICE is None or not shutil.which("ionice"):
+        return command
+    io_class, level = Config.ENCODER_IONICE
+    prefix = ["ionice", "-c", str(io_class)]
+    if io_class in (1, 2):
+        prefix += ["-n", str(level)]
+    return prefix + command
+
+def apply_policy(pid, role, cpus):
+    """Give a freshly spawned capture or encoder process its configured
+    scheduling class, nice value and cores, then check what it actually got.
+
+    Scheduling class, nice and affinity survive exec, so this also covers
+    processes that are still in a wrapper such as ionice."""
+    pin_process(pid, cpus)
+    rt_priority = Config.CAPTURE_RT_PRIORITY if role == "capture" else 0
+    nice = Config.CAPTURE_NICE if role == "capture" else Config.ENCODER_NICE
+    if rt_priority:
+        try:
+            os.sched_setscheduler(pid, os.SCHED_FIFO, os.sched_param(rt_priority))
+        except OSError as e:
+            if (role, "fifo") not in reported:
+                reported.add((role, "fifo"))
+                log(f"Could not give {role} (pid {pid}) SCHED_FIFO priority {rt_priority}, "
+                    f"using nice {nice} instead (needs CAP_SYS_NICE or LimitRTPRIO): {str(e)}")
+            rt_priority = 0
+    if not rt_priority and nice is not None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, nice)
+        except OSError as e:
+            if (role, "nice") not in reported:
+                reported.add((role, "nice"))
+                log(f"Could not set nice {nice} on {role} (pid {pid}), needs LimitNICE: {str(e)}")
+    verify_policy(pid, role, rt_priority, nice, cpus)
+
+def verify_policy(pid, role, rt_priority, nice, cpus):
+    """Log what pid is running with the first time a role is spawned, and
+    whenever it differs from what was asked for in a new way."""
+    try:
+        policy = os.sched_getscheduler(pid)
+        priority = os.sched_getparam(pid).sched_priority
+        actual_nice = os.getpriority(os.PRIO_PROCESS, pid)
+        actual_cpus = os.sched_getaffinity(pid)
+    except OSError:
+        return  # already exited; the pipeline reports that itself
+    mismatches = []
+    if rt_priority and (policy != os.SCHED_FIFO or priority != rt_priority):
+        mismatches.append(f"wanted fifo/{rt_priority}")
+    if not rt_priority and nice is not None and actual_nice != nice:
+        mismatches.append(f"wanted nice {nice}")
+    if cpus and actual_cpus != set(cpus):
+        mismatches.append(f"wanted cores {sorted(cpus)}")
+    key = (role, tuple(mismatches))
+    if key in reported:
+        return
+    reported.add(key)
+    summary = (f"{role} pid {pid}: {POLICY_NAMES.get(policy, policy)}/{priority}, nice {actual_nice}, "
+               f"cores {sorted(actual_cpus)}")
+    if mismatches:
+        summary += f" ({', '.join(mismatches)})"
+    log(f"Process priority {summary}", event="process_priority", role=role, pid=pid,
+        policy=POLICY_NAMES.get(policy, policy), priority=priority, nice=actual_nice,
+        cpus=sorted(actual_cpus), ok=not mismatches)
+
+def lock_memory():
+    """mlockall() the recorder, so the capture pump never waits on a page
+    being read back in. Pages are locked as they are first touched."""
+    if not Config.LOCK_MEMORY:
+        return
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE | MCL_ONFAULT) != 0:
+        errno = ctypes.get_errno()
+        log(f"Could not lock recorder memory (needs LimitMEMLOCK=infinity): {os.strerror(errno)}")
+    else:
+        log("Recorder memory locked")
@@ -0,0 +1,121 @@
+import asyncio
+import collections
+import statistics
+import time
+
+from utils.logging import log
+from utils.metrics import metrics
+from config import Config
+
+STAGE_SECONDS = metrics.histogram("recorder_toggle_stage_seconds", "Time spent in each stage of a start or stop",
+                                  buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+TOGGLE_SECONDS = metrics.histogram("recorder_toggle_seconds", "Time from the key event to the last traced stage")
+
+class Trace:
+    """Wall-clock timestamps of the stages of one command, from the key event
+    (the kernel's evdev timestamp) to the bulb acknowledging it.
+
+    Stages are marked as they happen; the trace is recorded once end() has been
+    called and every expected stage has been marked, or after TRACE_TIMEOUT."""
+
+    def __init__(self, tracer, command, source, event_at=None):
+        self.tracer = tracer
+        self.command = command
+        self.action = None  # "start" or "stop" once the recorder acts on it
+        self.source = source
+        self.marks = {}  # stage -> time.time()
+        if event_at is not None:
+            self.marks["event"] = event_at
+        self.marks["queued"] = time.time()
+        self.awaiting = set()
+        self.ended = False
+        self.finished = False
+        self.timer = None
+
+    def mark(self, stage, at=None):
+        if self.finished or stage in self.marks:
+            return
+        self.marks[stage] = at if at is not None else time.time()
+        self.awaiting.discard(stage)
+        if self.ended and not self.awaiting:
+            self.finish()
+
+    def expect(self, *stages):
+        """Stages that are still to come after the command has returned."""
+        self.awaiting.update(stage for stage in stages if stage not in self.marks)
+
+    def end(self):
+        self.ended = True
+        if not self.awaiting:
+            self.finish()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(Config.TRACE_TIMEOUT, self.finish)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        if self.timer:
+            self.timer.cancel()
+        self.tracer.record(self)
+
+    def stages(self):
+        """[(stage, seconds since the previous stage)] in the order they happened."""
+        ordered = sorted(self.marks.items(), key=lambda item: item[1])
+        return [(stage, at - ordered[index - 1][1] if index else 0.0)
+                for index, (stage, at) in enumerate(ordered)]
+
+    def as_dict(self):
+        marks = sorted(self.marks.values())
+        return {
+            "command": self.command,
+            "action": self.action,
+            "source": self.source,
+            "at": marks[0],
+            "total_ms": round((marks[-1] - marks[0]) * 1000, 2),
+            "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in self.stages()[1:]},
+            "missing": sorted(self.awaiting),
+        }
+
+class ToggleTracer:
+    """Keeps the last TRACE_HISTORY traces and feeds per-stage histograms."""
+
+    def __init__(self):
+        self.history = collections.deque(maxlen=Config.TRACE_HISTORY)
+
+    def begin(self, command, source, event_at=None):
+        return Trace(self, command, source, event_at)
+
+    def record(self, trace):
+        if trace.action is None:
+            # Nothing happened, e.g. start while already recording
+            return
+        stages = trace.stages()
+        for stage, seconds in stages[1:]:
+            STAGE_SECONDS.observe(seconds, action=trace.action, stage=stage)
+        total = sum(seconds for _, seconds in stages)
+        TOGGLE_SECONDS.observe(total, action=trace.action)
+        self.history.append(trace)
+        summary = ", ".join(f"{stage} +{seconds * 1000:.1f}ms" for stage, seconds in stages[1:])
+        missing = f" (no {', '.join(sorted(trace.awaiting))})" if trace.awaiting else ""
+        log(f"Toggle trace ({trace.action} from {trace.source}): {summary}; total {total * 1000:.1f}ms{missing}",
+            event="toggle_trace", **trace.as_dict())
+
+    def dump(self):
+        """Recent traces and per-stage median/p95/max over them, in milliseconds."""
+        durations = collections.defaultdict(list)
+        for trace in self.history:
+            for stage, seconds in trace.stages()[1:]:
+                durations[(trace.action, stage)].append(seconds * 1000)
+        summary = collections.defaultdict(dict)
+        for (action, stage), values in durations.items():
+            values.sort()
+            summary[action][stage] = {
+                "count": len(values),
+                "median": round(statistics.median(values), 2),
+                "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 2),
+                "max": round(values[-1], 2),
+            }
+        return {"stages": summary, "traces": [trace.as_dict() for trace in self.history]}
+
+tracer = ToggleTracer()
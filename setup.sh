@@ -16,7 +16,9 @@ apt install -y \
     nginx \
     samba \
     python3-evdev \
-    python3-venv
+    python3-venv \
+    python3-numpy \
+    flac
 
 # Add pi user to audio group
 usermod -a -G audio pi
@@ -32,11 +34,14 @@ fi
 # Create recordings directory
 mkdir -p /srv/recordings
 
-# Create log directory and file
-mkdir -p /var/log
-touch /var/log/audio-recorder.log
-chown pi:audiofiles /var/log/audio-recorder.log
-chmod 664 /var/log/audio-recorder.log
+# Create log directory and file; the recorder rotates the log itself, which needs
+# write access to the directory, not just the file
+mkdir -p /var/log/audio-recorder
+chown pi:audiofiles /var/log/audio-recorder
+chmod 2775 /var/log/audio-recorder
+touch /var/log/audio-recorder/audio-recorder.log
+chown pi:audiofiles /var/log/audio-recorder/audio-recorder.log
+chmod 664 /var/log/audio-recorder/audio-recorder.log
 
 # Create bulb cache directory
 mkdir -p /var/lib/audio-recorder
@@ -109,10 +114,15 @@ After=network.target
 [Service]
 ExecStart=/home/pi/ps-audio-recorder/start-recorder.sh
 WorkingDirectory=/home/pi/ps-audio-recorder
-StandardOutput=append:/var/log/audio-recorder.log
-StandardError=append:/var/log/audio-recorder.log
+# The recorder writes and rotates LOG_FILE itself; tracebacks go to the journal
+StandardOutput=journal
+StandardError=journal
 Restart=always
 User=pi
+# Let the recorder raise arecord/lame priority and lock its memory (see config.py)
+LimitRTPRIO=99
+LimitNICE=-20
+LimitMEMLOCK=infinity
 
 [Install]
 WantedBy=multi-user.target